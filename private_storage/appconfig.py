@@ -5,9 +5,45 @@ PRIVATE_STORAGE_ROOT = getattr(settings, 'PRIVATE_STORAGE_ROOT', None)
 PRIVATE_STORAGE_SERVER = getattr(settings, 'PRIVATE_STORAGE_SERVER', 'django')
 PRIVATE_STORAGE_AUTH_FUNCTION = getattr(settings, 'PRIVATE_STORAGE_AUTH_FUNCTION', 'private_storage.permissions.allow_superuser')
 
+# For the streaming server, the chunk size and number of chunks to read ahead in a background thread.
+# Storages can override these with a ``streaming_chunk_size`` and ``streaming_read_ahead`` attribute.
+PRIVATE_STORAGE_STREAMING_CHUNK_SIZE = getattr(settings, 'PRIVATE_STORAGE_STREAMING_CHUNK_SIZE', 64 * 1024)
+PRIVATE_STORAGE_STREAMING_READ_AHEAD = getattr(settings, 'PRIVATE_STORAGE_STREAMING_READ_AHEAD', 0)
+
 # For Nginx X-Accel-Redirect
 PRIVATE_STORAGE_INTERNAL_URL = getattr(settings, 'PRIVATE_STORAGE_INTERNAL_URL', '/private-x-accel-redirect/')
 PRIVATE_STORAGE_NGINX_VERSION = getattr(settings, 'PRIVATE_STORAGE_NGINX_VERSION', None)
+PRIVATE_STORAGE_NGINX_PROXY_URL = getattr(settings, 'PRIVATE_STORAGE_NGINX_PROXY_URL', '/private-x-accel-proxy/')
+
+# For the presigned URLs of the redirect and nginx servers, the number of seconds the URL is valid.
+PRIVATE_STORAGE_REDIRECT_EXPIRE = getattr(settings, 'PRIVATE_STORAGE_REDIRECT_EXPIRE', 60)
 
 PRIVATE_STORAGE_S3_REVERSE_PROXY = getattr(settings, 'PRIVATE_STORAGE_S3_REVERSE_PROXY', False)
 PRIVATE_STORAGE_MINO_REVERSE_PROXY = getattr(settings, 'PRIVATE_STORAGE_MINO_REVERSE_PROXY', False)
+
+# For the PrivateLocalCacheStorage, the remote storage class, the local folder and its maximum size in bytes.
+PRIVATE_STORAGE_LOCAL_CACHE_BACKEND = getattr(settings, 'PRIVATE_STORAGE_LOCAL_CACHE_BACKEND', None)
+PRIVATE_STORAGE_LOCAL_CACHE_ROOT = getattr(settings, 'PRIVATE_STORAGE_LOCAL_CACHE_ROOT', None)
+PRIVATE_STORAGE_LOCAL_CACHE_MAX_SIZE = getattr(settings, 'PRIVATE_STORAGE_LOCAL_CACHE_MAX_SIZE', 1024 * 1024 * 1024)
+
+# For the streaming servers, the bytes of small files to keep in memory, and the maximum size of these files.
+PRIVATE_STORAGE_MEMORY_CACHE_SIZE = getattr(settings, 'PRIVATE_STORAGE_MEMORY_CACHE_SIZE', 0)
+PRIVATE_STORAGE_MEMORY_CACHE_MAX_FILE_SIZE = getattr(settings, 'PRIVATE_STORAGE_MEMORY_CACHE_MAX_FILE_SIZE', 64 * 1024)
+
+# Let concurrent requests for the same file share a single storage request.
+PRIVATE_STORAGE_COALESCE_REQUESTS = getattr(settings, 'PRIVATE_STORAGE_COALESCE_REQUESTS', True)
+
+# Caching of file metadata, by naming one of the CACHES (e.g. 'default').
+PRIVATE_STORAGE_METADATA_CACHE = getattr(settings, 'PRIVATE_STORAGE_METADATA_CACHE', None)
+PRIVATE_STORAGE_METADATA_CACHE_TIMEOUT = getattr(settings, 'PRIVATE_STORAGE_METADATA_CACHE_TIMEOUT', 60)
+PRIVATE_STORAGE_METADATA_CACHE_MISSING_TIMEOUT = getattr(settings, 'PRIVATE_STORAGE_METADATA_CACHE_MISSING_TIMEOUT', 10)
+
+# Caching of permission decisions, by naming one of the CACHES (e.g. 'default').
+PRIVATE_STORAGE_PERMISSION_CACHE = getattr(settings, 'PRIVATE_STORAGE_PERMISSION_CACHE', None)
+PRIVATE_STORAGE_PERMISSION_CACHE_TIMEOUT = getattr(settings, 'PRIVATE_STORAGE_PERMISSION_CACHE_TIMEOUT', 30)
+
+# For signed download URLs, the number of seconds the URL is valid.
+PRIVATE_STORAGE_TOKEN_EXPIRE = getattr(settings, 'PRIVATE_STORAGE_TOKEN_EXPIRE', 3600)
+
+# Send the timings of the view in a ``Server-Timing`` header.
+PRIVATE_STORAGE_SERVER_TIMING = getattr(settings, 'PRIVATE_STORAGE_SERVER_TIMING', False)
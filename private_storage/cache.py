@@ -0,0 +1,180 @@
+"""
+Caching of file metadata and permission decisions, using the Django cache framework.
+
+These are enabled by the ``PRIVATE_STORAGE_METADATA_CACHE`` and ``PRIVATE_STORAGE_PERMISSION_CACHE`` settings.
+"""
+import hashlib
+import uuid
+
+from django.core.cache import caches
+
+from . import appconfig
+from .singleflight import metadata_requests
+
+#: The value stored for files that don't exist.
+MISSING = 'missing'
+
+
+def get_metadata_cache():
+    """
+    Return the cache to store metadata in, or ``None`` when caching is disabled.
+    """
+    if not appconfig.PRIVATE_STORAGE_METADATA_CACHE:
+        return None
+    return caches[appconfig.PRIVATE_STORAGE_METADATA_CACHE]
+
+
+def get_storage_key(storage):
+    """
+    Return a key that identifies the storage, which is the same for every process.
+    """
+    storage_class = storage.__class__
+    return '{}.{}:{}:{}'.format(
+        storage_class.__module__,
+        storage_class.__qualname__,
+        getattr(storage, 'bucket_name', None) or '',
+        getattr(storage, 'location', None) or '',
+    )
+
+
+def get_metadata_key(storage, name):
+    """
+    Return the cache key for the metadata of a file.
+    """
+    key = f'{get_storage_key(storage)}:{name}'
+    return 'private_storage.stat.{}'.format(hashlib.sha256(key.encode('utf-8')).hexdigest())
+
+
+def get_metadata(storage, name, fetch):
+    """
+    Return the file metadata from the cache, or call ``fetch()`` and store the result.
+    Missing files are cached as well, but with a shorter timeout.
+    Concurrent calls for the same file share a single ``fetch()``.
+    """
+    key = get_metadata_key(storage, name)
+    cache = get_metadata_cache()
+    if cache is None:
+        return metadata_requests.do(key, fetch)
+
+    metadata = cache.get(key)
+    if metadata is None:
+        metadata = metadata_requests.do(key, lambda: _fetch_metadata(cache, key, fetch))
+    elif metadata == MISSING:
+        return None
+
+    return metadata
+
+
+def _fetch_metadata(cache, key, fetch):
+    metadata = fetch()
+    if metadata is None:
+        cache.set(key, MISSING, appconfig.PRIVATE_STORAGE_METADATA_CACHE_MISSING_TIMEOUT)
+    else:
+        cache.set(key, metadata, appconfig.PRIVATE_STORAGE_METADATA_CACHE_TIMEOUT)
+    return metadata
+
+
+def invalidate_metadata(storage, name):
+    """
+    Remove the cached metadata of a file, e.g. after it's saved or deleted.
+    """
+    cache = get_metadata_cache()
+    if cache is not None and name:
+        cache.delete(get_metadata_key(storage, name))
+
+
+def get_permission_cache():
+    """
+    Return the cache to store permission decisions in, or ``None`` when caching is disabled.
+    """
+    if not appconfig.PRIVATE_STORAGE_PERMISSION_CACHE:
+        return None
+    return caches[appconfig.PRIVATE_STORAGE_PERMISSION_CACHE]
+
+
+def _hash_key(prefix, key):
+    return '{}.{}'.format(prefix, hashlib.sha256(key.encode('utf-8')).hexdigest())
+
+
+def _get_user_key(user=None, session_key=None):
+    if user is not None and user.is_authenticated:
+        return f'user:{user.pk}'
+    elif session_key:
+        return f'session:{session_key}'
+    else:
+        return None
+
+
+#: Changing one of the generations makes all previous cache keys of permission decisions obsolete.
+PERMISSION_GENERATION_KEY = 'private_storage.perm.gen'
+
+
+def _get_user_generation_key(user_key):
+    return _hash_key('private_storage.perm.gen.user', user_key)
+
+
+def _get_file_generation_key(storage, name):
+    return _hash_key('private_storage.perm.gen.file', f'{get_storage_key(storage)}:{name}')
+
+
+def get_permission(private_file, check, scope=''):
+    """
+    Return the cached permission decision for the current user or session, or call ``check(private_file)``.
+    Both allowed and denied access is cached. The ``scope`` separates the decisions of different views.
+    Requests without a user or session are always checked.
+    """
+    cache = get_permission_cache()
+    if cache is None:
+        return check(private_file)
+
+    request = private_file.request
+    session = getattr(request, 'session', None)
+    user_key = _get_user_key(getattr(request, 'user', None), getattr(session, 'session_key', None))
+    if user_key is None:
+        return check(private_file)
+
+    generation_keys = [
+        PERMISSION_GENERATION_KEY,
+        _get_user_generation_key(user_key),
+        _get_file_generation_key(private_file.storage, private_file.relative_name),
+    ]
+    generations = cache.get_many(generation_keys)
+
+    parent = private_file.parent_object
+    key = _hash_key('private_storage.perm', '{}:{}:{}:{}:{}:{}'.format(
+        scope,
+        user_key,
+        get_storage_key(private_file.storage),
+        private_file.relative_name,
+        f'{parent._meta.label}.{parent.pk}' if parent is not None else '',
+        ':'.join(str(generations.get(generation_key, 0)) for generation_key in generation_keys),
+    ))
+
+    allowed = cache.get(key)
+    if allowed is None:
+        allowed = bool(check(private_file))
+        cache.set(key, allowed, appconfig.PRIVATE_STORAGE_PERMISSION_CACHE_TIMEOUT)
+    return allowed
+
+
+def invalidate_permissions(user=None, session_key=None, storage=None, name=None):
+    """
+    Remove the cached permission decisions of a user (or session), or of a file.
+    Without arguments, all cached decisions are removed.
+    """
+    cache = get_permission_cache()
+    if cache is None:
+        return
+
+    keys = []
+    user_key = _get_user_key(user, session_key)
+    if user_key is not None:
+        keys.append(_get_user_generation_key(user_key))
+    if storage is not None and name:
+        keys.append(_get_file_generation_key(storage, name))
+    if user is None and session_key is None and storage is None:
+        keys.append(PERMISSION_GENERATION_KEY)
+
+    # Decisions expire by themselves, so the generation only needs to be kept that long.
+    generation = uuid.uuid4().hex
+    cache.set_many({key: generation for key in keys}, appconfig.PRIVATE_STORAGE_PERMISSION_CACHE_TIMEOUT)
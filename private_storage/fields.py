@@ -1,23 +1,112 @@
 import datetime
+import hashlib
 import logging
+import mimetypes
 import os
 import posixpath
 import warnings
 
+from django.apps import apps
 from django.core import checks
 from django.core.exceptions import ValidationError
 from django.core.files.uploadedfile import UploadedFile
-from django.db import models
-from django.db.models.fields.files import ImageFieldFile, ImageFileDescriptor
+from django.db import models, transaction
+from django.db.models.fields.files import FieldFile, ImageFieldFile, ImageFileDescriptor
 from django.forms import ImageField
 from django.template.defaultfilters import filesizeformat
+from django.utils import timezone
 from django.utils.encoding import force_str
 from django.utils.translation import gettext_lazy as _
 
+from .cache import invalidate_metadata
 from .storage import private_storage
 
 logger = logging.getLogger(__name__)
 
+CONTENT_HASH_LENGTH = 64
+
+
+def get_content_hash(content):
+    """
+    Calculate the SHA-256 hash of a file, reading it in chunks.
+    """
+    hasher = hashlib.sha256()
+    for chunk in content.chunks():
+        hasher.update(chunk)
+    content.seek(0)
+    return hasher.hexdigest()
+
+
+class PrivateFieldFile(FieldFile):
+    """
+    The file object of a :class:`PrivateFileField`.
+    This clears the cached metadata when a file is saved or deleted.
+    """
+
+    @property
+    def url(self):
+        # Reuse the URL that PrivateFileField.prefetch_urls() generated.
+        url = self.__dict__.get('_prefetched_url')
+        if url is not None and self.name == self.__dict__.get('_prefetched_name'):
+            return url
+        return super().url
+
+    @property
+    def content_hash(self):
+        """
+        The SHA-256 hash of the file contents, when the field uses ``deduplicate=True``.
+        """
+        return self.field.get_content_hash(self.name)
+
+    def save(self, name, content, save=True):
+        checksum = get_content_hash(content) if self.field.deduplicate or self.field.checksum_field else None
+        if self.field.deduplicate:
+            self._save_deduplicated(name, content, checksum)
+        else:
+            super().save(name, content, save=False)
+
+        self.field.update_metadata_fields(self.instance, content, checksum)
+        if save:
+            self.instance.save()
+        invalidate_metadata(self.storage, self.name)
+
+    def _save_deduplicated(self, name, content, content_hash):
+        # Files with the same contents share the same blob, so it's only stored once.
+        name = self.field.generate_hashed_filename(self.instance, name, content_hash)
+        if not self.storage.exists(name):
+            name = self.storage.save(name, content, max_length=self.field.max_length)
+        else:
+            # Another object's delete could still remove the blob, until this object is saved.
+            # The content is kept, so the blob can be stored again afterwards.
+            self.instance.__dict__[f'_{self.field.attname}_deduplicated_content'] = content
+        self.name = name
+        setattr(self.instance, self.field.attname, self.name)
+        self._committed = True
+
+    def delete(self, save=True):
+        name = self.name
+        if name and self.field.deduplicate and self.field.is_shared_file(self.instance, name):
+            # Other objects still reference the same blob, only detach it from this object.
+            self.close()
+            self.name = None
+            setattr(self.instance, self.field.attname, self.name)
+            self._committed = False
+        elif name:
+            super().delete(save=False)
+            invalidate_metadata(self.storage, name)
+        else:
+            return
+
+        self.field.update_metadata_fields(self.instance)
+        if save:
+            self.instance.save()
+
+
+class PrivateImageFieldFile(PrivateFieldFile, ImageFieldFile):
+    """
+    The file object of a :class:`PrivateImageField`.
+    """
+
 
 class PrivateFileField(models.FileField):
     """
@@ -27,7 +116,11 @@ class PrivateFileField(models.FileField):
     - ``upload_subfolder``: a lambda to find the subfolder, depending on the instance.
     - ``content_types``: list of allowed content types.
     - ``max_file_size``: maximum file size.
+    - ``deduplicate``: store files by their content hash, so identical uploads are stored once.
+    - ``size_field``, ``content_type_field``, ``modified_time_field``, ``checksum_field``:
+      names of model fields that record the file metadata when a file is saved.
     """
+    attr_class = PrivateFieldFile
     default_error_messages = {
         'invalid_file_type': _('File type not supported.'),
         'file_too_large': _('The file may not be larger than {max_size}.'),
@@ -37,9 +130,54 @@ class PrivateFileField(models.FileField):
         self.upload_subfolder = kwargs.pop('upload_subfolder', None)
         self.content_types = kwargs.pop("content_types", None) or ()
         self.max_file_size = kwargs.pop("max_file_size", None)
+        self.deduplicate = kwargs.pop("deduplicate", False)
+        self.size_field = kwargs.pop("size_field", None)
+        self.content_type_field = kwargs.pop("content_type_field", None)
+        self.modified_time_field = kwargs.pop("modified_time_field", None)
+        self.checksum_field = kwargs.pop("checksum_field", None)
 
-        kwargs.setdefault('storage', private_storage)
+        use_private_storage = kwargs.get('storage') is None
         super().__init__(*args, **kwargs)
+        if use_private_storage:
+            # Assigned afterwards, as the FileField tests the storage in a way that would initialize it.
+            self.storage = private_storage
+
+    def check(self, **kwargs):
+        return [
+            *super().check(**kwargs),
+            *self._check_deduplicate(),
+        ]
+
+    def _check_deduplicate(self):
+        if self.deduplicate and self.upload_subfolder:
+            return [
+                checks.Error(
+                    "'deduplicate' and 'upload_subfolder' can't be used together.",
+                    hint="Identical files of different objects share the same name, "
+                         "so these can't be stored in subfolders.",
+                    obj=self,
+                    id='private_storage.E001',
+                )
+            ]
+        return []
+
+    def contribute_to_class(self, cls, name, **kwargs):
+        super().contribute_to_class(cls, name, **kwargs)
+        if self.deduplicate and not cls._meta.abstract:
+            models.signals.post_save.connect(self._restore_deduplicated_file, sender=cls)
+
+    def _restore_deduplicated_file(self, instance, using=None, **kwargs):
+        # The existing blob was reused when the file was saved.
+        # Once this object is committed, the blob can no longer be removed, so check whether it still exists.
+        content = instance.__dict__.pop(f'_{self.attname}_deduplicated_content', None)
+        if content is not None:
+            name = getattr(instance, self.attname).name
+            transaction.on_commit(lambda: self._restore_blob(name, content), using=using)
+
+    def _restore_blob(self, name, content):
+        if not self.storage.exists(name):
+            logger.warning("Deduplicated file %s was removed while it was saved, storing it again.", name)
+            self.storage.save(name, content, max_length=self.max_length)
 
     def clean(self, *args, **kwargs):
         data = super().clean(*args, **kwargs)
@@ -49,11 +187,14 @@ class PrivateFileField(models.FileField):
             # and not for files which are already stored in the model.
             content_type = file.content_type
 
-            if self.content_types and content_type not in self.content_types:
+            # Files that the PrivateFileUploadHandler rejected while these were uploaded.
+            rejected_reason = getattr(file, 'rejected_reason', None)
+
+            if rejected_reason == 'invalid_file_type' or (self.content_types and content_type not in self.content_types):
                 logger.debug('Rejected uploaded file type: %s', content_type)
                 raise ValidationError(self.error_messages['invalid_file_type'])
 
-            if self.max_file_size and file.size > self.max_file_size:
+            if rejected_reason == 'file_too_large' or (self.max_file_size and file.size > self.max_file_size):
                 raise ValidationError(self.error_messages['file_too_large'].format(
                     max_size=filesizeformat(self.max_file_size),
                     size=filesizeformat(file.size)
@@ -61,17 +202,42 @@ class PrivateFileField(models.FileField):
 
         return data
 
+    def get_urls(self, instances):
+        """
+        Return the file URLs of multiple model instances, e.g. to render a list of objects.
+        This uses ``storage.urls(names)`` when the storage provides it,
+        which is faster than calling ``url()`` for each file.
+        Instances without a file have ``None`` as URL.
+        """
+        names = [getattr(instance, self.attname).name for instance in instances]
+        present_names = [name for name in names if name]
+
+        urls_method = getattr(self.storage, 'urls', None)
+        if urls_method is not None:
+            urls = iter(urls_method(present_names))
+        else:
+            urls = (self.storage.url(name) for name in present_names)
+
+        return [next(urls) if name else None for name in names]
+
+    def prefetch_urls(self, instances):
+        """
+        Generate the file URLs of multiple model instances at once,
+        so reading ``instance.field.url`` in a template or the admin no longer generates the URL.
+        """
+        instances = list(instances)
+        for instance, url in zip(instances, self.get_urls(instances)):
+            if url is not None:
+                file = getattr(instance, self.attname)
+                file._prefetched_url = url
+                file._prefetched_name = file.name
+
     def generate_filename(self, instance, filename):
         path_parts = []
 
         if self.upload_to:
-            # Support the upload_to callable that Django provides
-            if callable(self.upload_to):
-                dirname, filename = os.path.split(self.upload_to(instance, filename))
-                path_parts.append(dirname)
-            else:
-                dirname = force_str(datetime.datetime.now().strftime(force_str(self.upload_to)))
-                path_parts.append(dirname)
+            dirname, filename = self._get_upload_to(instance, filename)
+            path_parts.append(dirname)
 
         # Add our custom subdir function.
         upload_subfolder = self.upload_subfolder
@@ -92,6 +258,88 @@ class PrivateFileField(models.FileField):
         filename = posixpath.join(*path_parts)
         return self.storage.generate_filename(filename)
 
+    def generate_hashed_filename(self, instance, filename, content_hash):
+        """
+        Generate the content-addressed name for ``deduplicate=True``, e.g. ``upload_to/ab/cd/abcd....pdf``.
+        The ``upload_subfolder`` can't be used, as identical files of different objects should share the same name.
+        """
+        path_parts = []
+        if self.upload_to:
+            path_parts.append(self._get_upload_to(instance, filename)[0])
+
+        extension = os.path.splitext(self._get_clean_filename(filename))[1].lower()
+        path_parts.extend([content_hash[:2], content_hash[2:4], content_hash + extension])
+        return self.storage.generate_filename(posixpath.join(*path_parts))
+
+    def get_content_hash(self, name):
+        """
+        Return the content hash that a file name of ``deduplicate=True`` contains.
+        """
+        if not self.deduplicate or not name:
+            return None
+
+        content_hash = posixpath.splitext(posixpath.basename(name))[0]
+        if len(content_hash) != CONTENT_HASH_LENGTH or content_hash.strip('0123456789abcdef'):
+            return None
+        return content_hash
+
+    def is_shared_file(self, instance, name):
+        """
+        Tell whether other objects still reference the blob of a ``deduplicate=True`` field.
+        This checks all deduplicating fields that use the same storage.
+        """
+        for model in apps.get_models():
+            for field in model._meta.get_fields():
+                if not isinstance(field, PrivateFileField) or not field.deduplicate or field.storage is not self.storage:
+                    continue
+
+                queryset = model._default_manager.filter(**{field.name: name})
+                if field is self and instance.pk is not None:
+                    queryset = queryset.exclude(pk=instance.pk)
+                if queryset.exists():
+                    return True
+        return False
+
+    def update_metadata_fields(self, instance, content=None, checksum=None):
+        """
+        Record the metadata of a saved file in the ``*_field`` model fields.
+        Without ``content``, the fields are cleared.
+        """
+        if content is not None:
+            name = getattr(instance, self.attname).name
+            values = {
+                self.size_field: content.size,
+                self.content_type_field: mimetypes.guess_type(name)[0] or 'application/octet-stream',
+                self.modified_time_field: timezone.now(),
+                self.checksum_field: checksum,
+            }
+        else:
+            values = dict.fromkeys((self.size_field, self.content_type_field, self.modified_time_field, self.checksum_field))
+
+        for field_name, value in values.items():
+            if field_name:
+                setattr(instance, field_name, value)
+
+    def get_file_metadata(self, instance):
+        """
+        Return the file metadata that the ``*_field`` model fields recorded, with the same keys as ``storage.stat()``.
+        """
+        checksum = getattr(instance, self.checksum_field) if self.checksum_field else None
+        metadata = {
+            'size': getattr(instance, self.size_field) if self.size_field else None,
+            'content_type': getattr(instance, self.content_type_field) if self.content_type_field else None,
+            'modified_time': getattr(instance, self.modified_time_field) if self.modified_time_field else None,
+            'etag': f'"{checksum}"' if checksum else None,
+        }
+        return {key: value for key, value in metadata.items() if value is not None}
+
+    def _get_upload_to(self, instance, filename):
+        # Support the upload_to callable that Django provides
+        if callable(self.upload_to):
+            return os.path.split(self.upload_to(instance, filename))
+        else:
+            return force_str(datetime.datetime.now().strftime(force_str(self.upload_to))), filename
+
     def _get_clean_filename(self, filename):
         # As of Django 1.10+, file names are no longer cleaned locally, but cleaned by the storage.
         # This compatibility function makes sure all Django versions generate a safe filename.
@@ -99,7 +347,7 @@ class PrivateFileField(models.FileField):
 
 
 class PrivateImageField(PrivateFileField):
-    attr_class = ImageFieldFile
+    attr_class = PrivateImageFieldFile
     descriptor_class = ImageFileDescriptor
     description = _("Image")
 
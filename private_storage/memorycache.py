@@ -0,0 +1,110 @@
+"""
+A per-process cache of small file bodies, so frequently downloaded files are sent from memory.
+
+This is enabled by the ``PRIVATE_STORAGE_MEMORY_CACHE_SIZE`` setting.
+"""
+import threading
+from collections import OrderedDict
+
+from . import appconfig
+from .cache import get_storage_key
+from .singleflight import body_requests
+
+
+class MemoryCache:
+    """
+    A least-recently-used cache of file bodies, limited to ``max_size`` bytes in total.
+    Files larger than ``max_file_size`` are not cached.
+    """
+
+    def __init__(self, max_size, max_file_size):
+        self.max_size = max_size
+        self.max_file_size = max_file_size
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            body = self._entries.get(key)
+            if body is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            return body
+
+    def set(self, key, body):
+        if len(body) > self.max_file_size or len(body) > self.max_size:
+            return
+
+        with self._lock:
+            old_body = self._entries.pop(key, None)
+            if old_body is not None:
+                self.size -= len(old_body)
+
+            self._entries[key] = body
+            self.size += len(body)
+            while self.size > self.max_size:
+                _, evicted_body = self._entries.popitem(last=False)
+                self.size -= len(evicted_body)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+            self.hits = 0
+            self.misses = 0
+
+    def get_stats(self):
+        """
+        Return the number of hits and misses, and the current number of files and bytes in the cache.
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'files': len(self._entries),
+                'size': self.size,
+            }
+
+
+#: The cache of this process.
+memory_cache = MemoryCache(
+    max_size=appconfig.PRIVATE_STORAGE_MEMORY_CACHE_SIZE,
+    max_file_size=appconfig.PRIVATE_STORAGE_MEMORY_CACHE_MAX_FILE_SIZE,
+)
+
+
+def get_cached_body(private_file):
+    """
+    Return the contents of a small file from the memory cache, reading the file when it's not cached yet.
+    This returns ``None`` when the cache is disabled, or the file is too large to cache.
+    The ETag is part of the cache key, so a changed file is read again.
+    """
+    size = private_file.size
+    if not memory_cache.max_size or size > memory_cache.max_file_size:
+        return None
+
+    key = (get_storage_key(private_file.storage), private_file.relative_name, private_file.etag)
+    body = memory_cache.get(key)
+    if body is None:
+        # Concurrent requests for the same file share a single read.
+        body = body_requests.do(('memory', key), lambda: _read_body(private_file, key))
+    return body
+
+
+def _read_body(private_file, key):
+    size = private_file.size
+    if size:
+        file = private_file.open_range(0, size - 1)
+        try:
+            body = file.read()
+        finally:
+            file.close()
+    else:
+        body = b''
+    memory_cache.set(key, body)
+    return body
@@ -1,26 +1,51 @@
 import mimetypes
+import time
 
 #from django.core.files.storage import File, Storage
 from django.utils.functional import cached_property
 
+from .cache import get_metadata
+
+#: The properties of :class:`PrivateFile` which can be provided by ``storage.stat()``.
+METADATA_FIELDS = ('size', 'modified_time', 'content_type', 'etag')
+
 
 class PrivateFile:
     """
     A wrapper object that describes the file that is being accessed.
     """
 
-    def __init__(self, request, storage, relative_name, parent_object=None):
+    def __init__(self, request, storage, relative_name, parent_object=None, metadata=None):
         self.request = request
         self.storage = storage  # type: Storage
         self.relative_name = relative_name
         self.parent_object = parent_object
 
+        #: The ``Content-Disposition`` header the view will send, if any.
+        self.content_disposition = None
+
+        #: The time spent in each step of the download, see :mod:`private_storage.signals`.
+        self.timings = {}
+
+        if metadata is not None:
+            # Metadata that is already known (e.g. recorded in the database) is used as the result of stat(),
+            # so the storage isn't asked for it.
+            self.__dict__.update({
+                key: value for key, value in metadata.items()
+                if key in METADATA_FIELDS and value is not None
+            })
+            self._stat = metadata
+
     def __repr__(self):
         return f'<PrivateFile: {self.relative_name}>'
 
     @cached_property
     def full_path(self):
         # Not using self.storage.open() as the X-Sendfile needs a normal path.
+        # Storages that keep a local copy (e.g. the local cache) reuse the metadata that is already fetched.
+        cached_path = getattr(self.storage, 'cached_path', None)
+        if cached_path is not None:
+            return cached_path(self.relative_name, self.stat())
         return self.storage.path(self.relative_name)
 
     def open(self, mode='rb'):
@@ -28,14 +53,83 @@ class PrivateFile:
         Open the file for reading.
         :rtype: django.core.files.storage.File
         """
+        start = time.perf_counter()
         file = self.storage.open(self.relative_name, mode=mode)  # type: File
+        self.add_timing('open', start)
+        return file
+
+    def open_range(self, start, end):
+        """
+        Open the file for reading, positioned at byte ``start``.
+        The ``end`` offset is inclusive, reading should stop there.
+
+        Storages can implement ``open_range(name, start, end)`` to only fetch
+        the requested bytes, e.g. by doing a ranged GET on object storage.
+        """
+        open_range = getattr(self.storage, 'open_range', None)
+        if open_range is None:
+            file = self.open()
+            file.seek(start)
+            return file
+
+        start_time = time.perf_counter()
+        file = open_range(self.relative_name, start, end)
+        self.add_timing('open', start_time)
         return file
 
     def exists(self):
         """
         Check whether the file exists.
         """
-        return self.relative_name and self.storage.exists(self.relative_name)
+        return bool(self.relative_name) and self.stat() is not None
+
+    def stat(self):
+        """
+        Fetch the file metadata, and return it as dictionary.
+        This returns ``None`` when the file doesn't exist.
+
+        Storages can implement a ``stat(name)`` method that returns the ``size``, ``modified_time``,
+        ``content_type`` and ``etag`` in a single call, e.g. one HEAD request on object storage.
+        These values are used for the properties of this object, avoiding more storage calls.
+        Without such method, only the existence of the file is checked.
+
+        When ``PRIVATE_STORAGE_METADATA_CACHE`` is set, the result is cached.
+        """
+        try:
+            return self._stat
+        except AttributeError:
+            pass
+
+        if not self.relative_name:
+            metadata = None
+        else:
+            start = time.perf_counter()
+            metadata = get_metadata(self.storage, self.relative_name, self._fetch_stat)
+            self.add_timing('metadata', start)
+
+        if metadata:
+            # Fill the cached properties, so these are not fetched again.
+            # Values that were already assigned (e.g. by the view) are kept.
+            self.__dict__.update({
+                key: value for key, value in metadata.items()
+                if key in METADATA_FIELDS and value is not None and key not in self.__dict__
+            })
+
+        self._stat = metadata
+        return metadata
+
+    def add_timing(self, step, start):
+        """
+        Add the time since ``start`` to the :attr:`timings` of a step.
+        """
+        self.timings[step] = self.timings.get(step, 0.0) + (time.perf_counter() - start)
+
+    def _fetch_stat(self):
+        storage_stat = getattr(self.storage, 'stat', None)
+        if storage_stat is not None:
+            return storage_stat(self.relative_name)
+        else:
+            return {} if self.storage.exists(self.relative_name) else None
 
     @cached_property
     def content_type(self):
@@ -58,3 +152,17 @@ class PrivateFile:
         Return the last-modified time
         """
         return self.storage.get_modified_time(self.relative_name)
+
+    @cached_property
+    def etag(self):
+        """
+        Return the strong ``ETag`` of the file, including the quotes.
+        Storages can provide this with a ``get_etag(name)`` method,
+        otherwise it's derived from the file size and modification time.
+        """
+        get_etag = getattr(self.storage, 'get_etag', None)
+        if get_etag is not None:
+            return get_etag(self.relative_name)
+
+        mtime = int(self.modified_time.timestamp() * 1000000)
+        return f'"{self.size:x}-{mtime:x}"'
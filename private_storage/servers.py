@@ -4,17 +4,31 @@ Sending files efficiently for different kind of webservers.
 import os
 import sys
 import time
+import uuid
 from functools import lru_cache, wraps
 from urllib.parse import quote
 
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
-from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, HttpResponseRedirect, \
+    StreamingHttpResponse
 from django.utils import version
-from django.utils.http import http_date
+from django.utils.http import http_date, parse_etags
 from django.utils.module_loading import import_string
 from django.views.static import serve, was_modified_since
 
+from . import appconfig
+from .memorycache import get_cached_body
+from .streaming import ReadAheadIterator, aiter_file_range, aiter_mmap_range, amultipart_byteranges, get_chunk_size, \
+    get_read_ahead, iter_file_range, iter_mmap_range, multipart_byteranges
+
+try:
+    from asgiref.sync import sync_to_async
+    from django.core.handlers.asgi import ASGIRequest
+except ImportError:  # Django < 3.0
+    sync_to_async = None
+    ASGIRequest = None
+
 
 @lru_cache(maxsize=128)  # for backward compatibility
 def get_server_class(path):
@@ -28,9 +42,12 @@ def get_server_class(path):
         return ApacheXSendfileServer
     elif path == 'nginx':
         return NginxXAccelRedirectServer
+    elif path == 'redirect':
+        return PresignedRedirectServer
     else:
         raise ImproperlyConfigured(
-            "PRIVATE_STORAGE_SERVER setting should be 'nginx', 'apache', 'django' or a python class path."
+            "PRIVATE_STORAGE_SERVER setting should be 'nginx', 'apache', 'django', 'streaming',"
+            " 'redirect' or a python class path."
         )
 
 
@@ -50,39 +67,301 @@ def add_no_cache_headers(func):
     return _dec
 
 
+#: The maximum number of ranges in a ``Range`` header, after merging. Above this, the whole file is sent.
+MAX_RANGES = 20
+
+
+def parse_range_header(header, size):
+    """
+    Parse the HTTP ``Range`` header into a list of ``(start, end)`` tuples.
+    Both offsets are inclusive, as they are in the header.
+    Overlapping and adjacent ranges are merged, as RFC 7233 allows.
+
+    This returns ``None`` when the header is missing or invalid, so the whole file should be sent.
+    This also happens for more than :data:`MAX_RANGES` ranges, to avoid sending a response
+    that is many times the file size (RFC 7233 section 6.1).
+    An empty list is returned when none of the ranges can be satisfied.
+    """
+    if not header:
+        return None
+
+    unit, _, range_set = header.partition('=')
+    if unit.strip().lower() != 'bytes':
+        return None
+
+    ranges = []
+    for range_spec in range_set.split(','):
+        start, sep, end = range_spec.strip().partition('-')
+        if not sep or (start and not start.isdigit()) or (end and not end.isdigit()):
+            return None
+
+        if not start:
+            # Suffix range, e.g. "-500" for the last 500 bytes
+            if not end:
+                return None
+            suffix_length = int(end)
+            if suffix_length and size:
+                ranges.append((max(0, size - suffix_length), size - 1))
+        else:
+            start = int(start)
+            if not end:
+                end = size - 1
+            elif int(end) < start:
+                return None
+            else:
+                end = min(int(end), size - 1)
+            if start < size:
+                ranges.append((start, end))
+
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+
+    if len(merged) > MAX_RANGES:
+        return None
+    return merged
+
+
+def _strip_weak_prefix(etag):
+    return etag[2:] if etag.startswith('W/') else etag
+
+
+def is_not_modified(private_file):
+    """
+    Check the conditional request headers, to tell whether a ``304 Not Modified`` can be sent.
+    As RFC 7232 describes, ``If-None-Match`` takes precedence over ``If-Modified-Since``.
+    """
+    request = private_file.request
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        # The weak comparison is used here, the W/ prefix is ignored.
+        etags = [_strip_weak_prefix(etag) for etag in parse_etags(if_none_match)]
+        return '*' in etags or _strip_weak_prefix(private_file.etag) in etags
+
+    if_modified_since = request.META.get('HTTP_IF_MODIFIED_SINCE')
+    if if_modified_since:
+        mtime = private_file.modified_time.timestamp()
+        if version.get_main_version() >= '4.1':
+            return not was_modified_since(if_modified_since, mtime)
+        else:
+            return not was_modified_since(if_modified_since, mtime, private_file.size)
+
+    return False
+
+
+def not_modified_response(private_file):
+    """
+    Return the ``304 Not Modified`` response, without opening the file.
+    """
+    response = HttpResponseNotModified()
+    response['ETag'] = private_file.etag
+    return response
+
+
+def get_presigned_url(private_file):
+    """
+    Return a temporary URL to download the file from the storage directly.
+    This passes the content type and disposition on, so the storage sends the same headers.
+    """
+    content_disposition = private_file.content_disposition
+    if isinstance(content_disposition, bytes):
+        content_disposition = content_disposition.decode('utf-8')
+
+    return private_file.storage.presigned_url(
+        private_file.relative_name,
+        expire=appconfig.PRIVATE_STORAGE_REDIRECT_EXPIRE,
+        content_type=private_file.content_type,
+        content_disposition=content_disposition,
+    )
+
+
+def get_requested_ranges(private_file, last_modified):
+    """
+    Return the ranges requested by the client, or ``None`` to send the whole file.
+    This also checks the ``If-Range`` header, which only allows partial content
+    when the client still has the current version of the file.
+    """
+    request = private_file.request
+    if request.method != 'GET':
+        # RFC 7233: the Range header is only defined for GET requests.
+        return None
+
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range:
+        if if_range.startswith(('"', 'W/')):
+            # Entity tags use the strong comparison, weak tags never match.
+            if if_range != private_file.etag:
+                return None
+        elif if_range != last_modified:
+            return None
+
+    return parse_range_header(request.META.get('HTTP_RANGE'), private_file.size)
+
+
 class DjangoStreamingServer:
     """
     Serve static files through ``wsgi.file_wrapper`` or streaming chunks.
 
     This method also works for content that doesn't exist at the local filesystem, such as files on S3.
+    Small files can be sent from memory, see the ``PRIVATE_STORAGE_MEMORY_CACHE_SIZE`` setting.
+
+    Without ``wsgi.file_wrapper`` (e.g. in ASGI deployments), local files are memory mapped and sent in chunks.
+    This avoids the ``read()`` system calls, but each chunk is still copied into a new ``bytes`` object.
     """
 
-    @staticmethod
+    @classmethod
     @add_no_cache_headers
-    def serve(private_file):
-        # Support If-Last-Modified
-        mtime = private_file.modified_time.timestamp()
-        size = private_file.size
-        if version.get_main_version() >= '4.1':
-            was_modified = was_modified_since(private_file.request.META.get('HTTP_IF_MODIFIED_SINCE'), mtime)
-        else:
-            was_modified = was_modified_since(private_file.request.META.get('HTTP_IF_MODIFIED_SINCE'), mtime, size)
+    def serve(cls, private_file):
+        # Support If-None-Match and If-Modified-Since
+        if is_not_modified(private_file):
+            return not_modified_response(private_file)
 
-        if not was_modified: return HttpResponseNotModified()
+        last_modified = http_date(private_file.modified_time.timestamp())
+        ranges = get_requested_ranges(private_file, last_modified)
+        if ranges is not None:
+            return cls.serve_ranges(private_file, ranges, last_modified)
 
-        # As of Django 1.8, FileResponse triggers 'wsgi.file_wrapper' in Django's WSGIHandler.
-        # This uses efficient file streaming, such as sendfile() in uWSGI.
-        # When the WSGI container doesn't provide 'wsgi.file_wrapper', it submits the file in 4KB chunks.
         if private_file.request.method == 'HEAD':
             # Avoid reading the file at all
             response = HttpResponse()
         else:
-            response = FileResponse(private_file.open())
+            body = get_cached_body(private_file)
+            response = cls.get_file_response(private_file) if body is None else HttpResponse(body)
         response['Content-Type'] = private_file.content_type
         response['Content-Length'] = private_file.size
-        response["Last-Modified"] = http_date(mtime)
+        response["Last-Modified"] = last_modified
+        response['ETag'] = private_file.etag
+        response['Accept-Ranges'] = 'bytes'
         return response
 
+    @classmethod
+    def serve_ranges(cls, private_file, ranges, last_modified):
+        """
+        Send a ``206 Partial Content`` response for the requested ranges.
+        Only the requested bytes are read from the storage.
+        """
+        size = private_file.size
+        if not ranges:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            body = get_cached_body(private_file)
+            if body is None:
+                response = StreamingHttpResponse(cls.get_range_body(private_file, start, end), status=206)
+            else:
+                response = HttpResponse(body[start:end + 1], status=206)
+            response['Content-Type'] = private_file.content_type
+            response['Content-Length'] = end - start + 1
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        else:
+            boundary = uuid.uuid4().hex
+            content_length, body = cls.get_multipart_body(private_file, ranges, boundary)
+            response = StreamingHttpResponse(body, status=206)
+            response['Content-Type'] = f'multipart/byteranges; boundary={boundary}'
+            response['Content-Length'] = content_length
+
+        response['Last-Modified'] = last_modified
+        response['ETag'] = private_file.etag
+        response['Accept-Ranges'] = 'bytes'
+        return response
+
+    @classmethod
+    def get_file_response(cls, private_file):
+        """
+        Return the response that sends the whole file.
+        """
+        if get_read_ahead(private_file) or (
+                'wsgi.file_wrapper' not in private_file.request.META and cls.get_local_path(private_file)):
+            return StreamingHttpResponse(cls.get_range_body(private_file, 0, private_file.size - 1))
+
+        # As of Django 1.8, FileResponse triggers 'wsgi.file_wrapper' in Django's WSGIHandler.
+        # This uses efficient file streaming, such as sendfile() in uWSGI.
+        # When the WSGI container doesn't provide 'wsgi.file_wrapper', it submits the file in chunks.
+        response = FileResponse(private_file.open())
+        response.block_size = get_chunk_size(private_file)
+        return response
+
+    @classmethod
+    def get_range_body(cls, private_file, start, end):
+        """
+        Return the iterator that sends a single range of the file.
+        Local files are memory mapped.
+        """
+        full_path = cls.get_local_path(private_file)
+        if full_path is not None:
+            chunk_size = get_chunk_size(private_file)
+            if ASGIRequest is not None and isinstance(private_file.request, ASGIRequest):
+                return aiter_mmap_range(full_path, start, end, chunk_size=chunk_size)
+            else:
+                return iter_mmap_range(full_path, start, end, chunk_size=chunk_size)
+
+        body = iter_file_range(private_file, start, end, chunk_size=get_chunk_size(private_file))
+        return cls._read_ahead(private_file, body)
+
+    @classmethod
+    def get_multipart_body(cls, private_file, ranges, boundary):
+        """
+        Return the content length and iterator that send multiple ranges of the file.
+        """
+        content_length, body = multipart_byteranges(
+            private_file, ranges, boundary, chunk_size=get_chunk_size(private_file)
+        )
+        return content_length, cls._read_ahead(private_file, body)
+
+    @staticmethod
+    def get_local_path(private_file):
+        """
+        Return the path at the local filesystem, or ``None`` for remote storages.
+        """
+        start = time.perf_counter()
+        try:
+            full_path = private_file.full_path
+        except NotImplementedError:
+            return None
+        private_file.add_timing('open', start)
+        return full_path
+
+    @staticmethod
+    def _read_ahead(private_file, body):
+        read_ahead = get_read_ahead(private_file)
+        return ReadAheadIterator(body, read_ahead) if read_ahead else body
+
+
+class AsyncDjangoStreamingServer(DjangoStreamingServer):
+    """
+    Serve files with async iterators, for ASGI deployments.
+    Use this with the :class:`~private_storage.views.AsyncPrivateStorageView`.
+
+    The file is read in chunks in a thread pool, so no thread is held
+    while the data is being sent to the client. This requires Django 4.2 or newer.
+    """
+
+    @classmethod
+    async def serve(cls, private_file):
+        # Metadata that isn't fetched yet is retrieved in the thread, the body is only read later.
+        return await sync_to_async(super().serve, thread_sensitive=False)(private_file)
+
+    @classmethod
+    def get_file_response(cls, private_file):
+        return StreamingHttpResponse(cls.get_range_body(private_file, 0, private_file.size - 1))
+
+    @classmethod
+    def get_range_body(cls, private_file, start, end):
+        full_path = cls.get_local_path(private_file)
+        if full_path is not None:
+            return aiter_mmap_range(full_path, start, end, chunk_size=get_chunk_size(private_file))
+        return aiter_file_range(private_file, start, end, chunk_size=get_chunk_size(private_file))
+
+    @classmethod
+    def get_multipart_body(cls, private_file, ranges, boundary):
+        return amultipart_byteranges(private_file, ranges, boundary, chunk_size=get_chunk_size(private_file))
+
 
 class DjangoServer(DjangoStreamingServer):
     """
@@ -111,8 +390,18 @@ class DjangoServer(DjangoStreamingServer):
             # S3 files, fall back to streaming server
             return DjangoStreamingServer.serve(private_file)
         else:
+            if private_file.request.method == 'GET' and 'HTTP_RANGE' in private_file.request.META:
+                # Django's serve() has no support for partial content.
+                return DjangoStreamingServer.serve(private_file)
+
+            if is_not_modified(private_file):
+                return not_modified_response(private_file)
+
             # Using Django's serve gives If-Modified-Since support out of the box.
             response = serve(private_file.request, full_path, document_root='/', show_indexes=False)
+            if response.status_code == 200:
+                response['ETag'] = private_file.etag
+                response['Accept-Ranges'] = 'bytes'
             if private_file.request.method == 'HEAD' and response.status_code == 200:
                 # Avoid reading the file at all, copy FileResponse headers
                 # This is not needed for HttpResponseNotModified(), hence the 200 code check
@@ -132,9 +421,13 @@ class ApacheXSendfileServer:
     @staticmethod
     @add_no_cache_headers
     def serve(private_file):
+        if is_not_modified(private_file):
+            return not_modified_response(private_file)
+
         response = HttpResponse()
         response['X-Sendfile'] = private_file.full_path
         response['Content-Type'] = private_file.content_type
+        response['ETag'] = private_file.etag
         return response
 
 
@@ -149,6 +442,20 @@ class NginxXAccelRedirectServer:
         )
 
     Or update the ``PRIVATE_STORAGE_INTERNAL_URL`` setting to use a different URL prefix.
+
+    Files without a local path (e.g. on S3 or MinIO) are streamed by nginx from the bucket.
+    The presigned URL is passed in the ``X-Private-Storage-Url`` header,
+    which the ``PRIVATE_STORAGE_NGINX_PROXY_URL`` location passes to ``proxy_pass``::
+
+        location /private-x-accel-proxy/ {
+            internal;
+            resolver 1.1.1.1;
+            set $private_storage_url $upstream_http_x_private_storage_url;
+            proxy_pass $private_storage_url;
+        }
+
+    The ``accel_buffering``, ``accel_limit_rate`` and ``accel_expires`` attributes
+    can be set in a subclass, and used as ``server_class`` of a view.
     """
 
     @staticmethod
@@ -169,13 +476,77 @@ class NginxXAccelRedirectServer:
         # nginx 1.5.9 was released in 2014, so just assume most people have that
         return True
 
-    @staticmethod
+    #: The ``X-Accel-Buffering`` value, e.g. ``'no'`` to stream large files without buffering.
+    accel_buffering = None
+
+    #: The ``X-Accel-Limit-Rate`` value, which limits the download speed in bytes per second.
+    accel_limit_rate = None
+
+    #: The ``X-Accel-Expires`` value, the number of seconds nginx may cache the response.
+    accel_expires = None
+
+    @classmethod
     @add_no_cache_headers
-    def serve(private_file):
-        internal_url = os.path.join(settings.PRIVATE_STORAGE_INTERNAL_URL, private_file.relative_name)
-        if NginxXAccelRedirectServer.should_quote():
-            internal_url = quote(internal_url)
+    def serve(cls, private_file):
+        if is_not_modified(private_file):
+            return not_modified_response(private_file)
+
         response = HttpResponse()
+        if cls.has_local_path(private_file):
+            internal_url = os.path.join(appconfig.PRIVATE_STORAGE_INTERNAL_URL, private_file.relative_name)
+            if cls.should_quote():
+                internal_url = quote(internal_url)
+        else:
+            # Let nginx stream the object from the bucket, using a presigned URL.
+            # The location block reads this header as $upstream_http_x_private_storage_url.
+            internal_url = os.path.join(appconfig.PRIVATE_STORAGE_NGINX_PROXY_URL, quote(private_file.relative_name))
+            response['X-Private-Storage-Url'] = get_presigned_url(private_file)
+
         response['X-Accel-Redirect'] = internal_url
         response['Content-Type'] = private_file.content_type
+        response['ETag'] = private_file.etag
+
+        if cls.accel_buffering is not None:
+            if isinstance(cls.accel_buffering, bool):
+                response['X-Accel-Buffering'] = 'yes' if cls.accel_buffering else 'no'
+            else:
+                response['X-Accel-Buffering'] = cls.accel_buffering
+        if cls.accel_limit_rate is not None:
+            response['X-Accel-Limit-Rate'] = cls.accel_limit_rate
+        if cls.accel_expires is not None:
+            response['X-Accel-Expires'] = cls.accel_expires
         return response
+
+    @staticmethod
+    def has_local_path(private_file):
+        """
+        Tell whether the file is stored at the local filesystem, where nginx can read it.
+        """
+        try:
+            private_file.full_path
+        except NotImplementedError:
+            return False
+        else:
+            return True
+
+
+class PresignedRedirectServer:
+    """
+    Redirect to a temporary URL of the storage, such as a presigned S3 URL.
+
+    The access check still happens in Django, but the file is downloaded directly from the bucket.
+    This requires a storage with a ``presigned_url()`` method, such as the S3 and MinIO storages.
+    Files of other storages (e.g. the local filesystem) are sent like the ``streaming`` server does.
+    The ``PRIVATE_STORAGE_REDIRECT_EXPIRE`` setting defines how long the URL stays valid.
+    """
+
+    @staticmethod
+    def serve(private_file):
+        if getattr(private_file.storage, 'presigned_url', None) is None:
+            return DjangoStreamingServer.serve(private_file)
+        return PresignedRedirectServer.redirect(private_file)
+
+    @staticmethod
+    @add_no_cache_headers
+    def redirect(private_file):
+        return HttpResponseRedirect(get_presigned_url(private_file))
@@ -0,0 +1,30 @@
+"""
+Signals to instrument the download of private files.
+
+The ``timings`` argument is a dictionary with the elapsed time in seconds of each step:
+
+* ``auth``: the ``can_access_file()`` check.
+* ``metadata``: fetching the file metadata from the storage (or cache).
+* ``open``: opening the file in the storage, e.g. the GET request on object storage.
+* ``serve``: generating the response in the server class, this may include ``open``.
+* ``first_byte``: the time since the view started, until the first chunk of the body was generated.
+* ``total``: the time since the view started, until the whole body was generated.
+
+Steps that didn't happen (yet) are not included.
+"""
+from django.dispatch import Signal
+
+#: Sent by the view when the response is generated, before the body is sent.
+#: The arguments are ``request``, ``private_file``, ``response``, ``server_class`` and ``timings``.
+file_served = Signal()
+
+#: Sent when the body of the response has been generated, or when the client disconnected.
+#: The arguments are those of :data:`file_served`, and ``bytes_sent``.
+#: Listening to this signal disables ``wsgi.file_wrapper``, as the body is counted while it's sent.
+file_sent = Signal()
+
+#: Sent by the shared connection pools of the S3 and MinIO storages, when a request takes a connection.
+#: The arguments are ``host``, ``wait`` (the seconds spent waiting for the pool)
+#: and ``new_connection`` (whether a new connection, and TLS handshake, was needed).
+#: The sender is the urllib3 connection pool class.
+connection_pool_wait = Signal()
@@ -0,0 +1,71 @@
+"""
+Coalescing of concurrent storage requests for the same file.
+
+When many requests download the same file at once, only the first one fetches the metadata or file
+from the storage. The other threads wait for that result, instead of sending the same request to the bucket.
+This is enabled by default, and can be disabled with ``PRIVATE_STORAGE_COALESCE_REQUESTS = False``.
+
+The async views call the storage in worker threads, so these requests are coalesced as well.
+"""
+import threading
+
+from . import appconfig
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Run a function once for all threads that request the same key at the same time.
+    The ``coalesced`` attribute counts the calls that reused the result of another thread.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.coalesced = 0
+
+    def do(self, key, func):
+        """
+        Return the result of ``func()``, or wait for the thread that is already calling it for this key.
+        An exception of ``func()`` is raised in all waiting threads.
+        """
+        if not appconfig.PRIVATE_STORAGE_COALESCE_REQUESTS:
+            return func()
+
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+
+        if not is_leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+
+#: Coalesces the metadata requests, e.g. a HEAD request on object storage.
+metadata_requests = SingleFlight()
+
+#: Coalesces reading a whole file, e.g. to fill the memory or local disk cache.
+body_requests = SingleFlight()
@@ -1,6 +1,7 @@
 """
 Django Storage interface
 """
+from django.utils.functional import LazyObject
 from django.utils.module_loading import import_string
 
 from private_storage import appconfig
@@ -10,8 +11,23 @@ __all__ = (
     'PrivateStorage',
 )
 
-# Fetch the storage class
-PrivateStorage = import_string(appconfig.PRIVATE_STORAGE_CLASS)
+
+def __getattr__(name):
+    # The storage class is only imported when it's used, as this could import boto3 or minio.
+    if name == 'PrivateStorage':
+        return import_string(appconfig.PRIVATE_STORAGE_CLASS)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class LazyPrivateStorage(LazyObject):
+    """
+    The storage instance, which is created on first use.
+    This avoids creating clients for S3 or MinIO in processes that only import the models.
+    """
+
+    def _setup(self):
+        self._wrapped = import_string(appconfig.PRIVATE_STORAGE_CLASS)()
+
 
 # Singleton instance.
-private_storage = PrivateStorage()
+private_storage = LazyPrivateStorage()
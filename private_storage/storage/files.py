@@ -1,10 +1,13 @@
 """
 Django Storage interface, using the file system backend.
 """
+import os
+from urllib.parse import urljoin
+
 from django.core.files.storage import FileSystemStorage
 from django.urls import reverse_lazy
 from django.utils.deconstruct import deconstructible
-from django.utils.encoding import force_str
+from django.utils.encoding import filepath_to_uri, force_str
 
 from private_storage import appconfig
 
@@ -35,3 +38,43 @@ class PrivateFileSystemStorage(FileSystemStorage):
         # Make sure reverse_lazy() is evaluated
         self.base_url = force_str(self.base_url)
         return super().url(name)
+
+    def urls(self, names):
+        """
+        Return the URLs of multiple files, e.g. to render a list of objects.
+        """
+        base_url = self.base_url = force_str(self.base_url)
+        urls = []
+        for name in names:
+            url = filepath_to_uri(name).lstrip('/')
+            if base_url.endswith('/') and '/.' not in f'/{url}':
+                # Plain concatenation gives the same result as urljoin(), unless there are "." or ".." segments.
+                # Other special characters are already escaped by filepath_to_uri().
+                urls.append(base_url + url)
+            else:
+                urls.append(urljoin(base_url, url))
+        return urls
+
+    def get_etag(self, name):
+        """
+        Return a strong ETag, based on the size, modification time and inode of the file.
+        """
+        return self._get_stat_etag(os.stat(self.path(name)))
+
+    def stat(self, name):
+        """
+        Return all metadata of the file, using a single ``stat()`` system call.
+        """
+        try:
+            stat = os.stat(self.path(name))
+        except FileNotFoundError:
+            return None
+
+        return {
+            'size': stat.st_size,
+            'modified_time': self._datetime_from_timestamp(stat.st_mtime),
+            'etag': self._get_stat_etag(stat),
+        }
+
+    def _get_stat_etag(self, stat):
+        return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}-{stat.st_ino:x}"'
@@ -0,0 +1,302 @@
+"""
+Django Storage interface, keeping a local copy of files that are stored remotely (e.g. on S3 or MinIO).
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files import File
+from django.core.files.storage import Storage
+from django.utils.deconstruct import deconstructible
+from django.utils.module_loading import import_string
+
+from private_storage import appconfig
+from private_storage.cache import get_metadata
+from private_storage.singleflight import body_requests
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+@deconstructible
+class PrivateLocalCacheStorage(Storage):
+    """
+    Wrap a remote storage, and keep a local copy of the files that are read.
+
+    The local copy is used as long as its ETag matches the remote file.
+    As :meth:`path` returns the local copy, the ``django``, ``streaming``, ``apache`` and ``nginx``
+    servers send the file from the local disk, instead of downloading it from the bucket again.
+    The least recently used files are removed when the cache grows beyond ``max_size`` bytes.
+    Files larger than ``max_size`` are not cached, these are read from the remote storage.
+
+    The files are stored in the ``files`` folder of the ``location``, with the same names as the remote storage.
+    """
+
+    def __init__(self, storage=None, location=None, max_size=None):
+        if storage is None:
+            storage = appconfig.PRIVATE_STORAGE_LOCAL_CACHE_BACKEND
+            if not storage:
+                raise ImproperlyConfigured("The PRIVATE_STORAGE_LOCAL_CACHE_BACKEND setting is required.")
+        if isinstance(storage, str):
+            storage = import_string(storage)()
+        if location is None:
+            location = appconfig.PRIVATE_STORAGE_LOCAL_CACHE_ROOT
+            if not location:
+                raise ImproperlyConfigured("The PRIVATE_STORAGE_LOCAL_CACHE_ROOT setting is required.")
+        if max_size is None:
+            max_size = appconfig.PRIVATE_STORAGE_LOCAL_CACHE_MAX_SIZE
+
+        self.storage = storage
+        self.location = os.path.abspath(location)
+        self.max_size = max_size
+        self.files_location = os.path.join(self.location, 'files')
+        self.etags_location = os.path.join(self.location, 'etags')
+        self._lock = threading.RLock()
+        self._total_size = None  # Calculated on first use, and tracked afterwards.
+
+        # Used by the metadata cache to tell storages apart.
+        self.bucket_name = getattr(storage, 'bucket_name', None)
+
+    def path(self, name):
+        """
+        Return the path of the local copy, which is downloaded when it's missing or outdated.
+        Files larger than the cache raise ``NotImplementedError``, like remote storages do,
+        so the servers read these from the remote storage.
+        """
+        return self.cached_path(name, get_metadata(self, name, lambda: self.stat(name)))
+
+    def cached_path(self, name, metadata):
+        """
+        Return the path of the local copy, using the metadata of the remote file that was already fetched.
+        :class:`~private_storage.models.PrivateFile` uses this, so the remote file isn't checked twice.
+        """
+        if metadata is None:
+            raise FileNotFoundError(f"File does not exist: {name}")
+
+        size = metadata.get('size')
+        etag = metadata.get('etag')
+        if size is None or etag is None:
+            raise NotImplementedError(f"The file can't be cached without its size and ETag: {name}")
+        elif size > self.max_size:
+            raise NotImplementedError(f"The file is larger than the local cache: {name}")
+
+        full_path = self._get_cache_path(self.files_location, name)
+        etag_path = self._get_cache_path(self.etags_location, name)
+        if self._read_etag(etag_path) == etag and os.path.exists(full_path):
+            # The modification time of the ETag file tracks the last use, for the LRU eviction.
+            os.utime(etag_path)
+            return full_path
+
+        # Concurrent requests for the same file share a single download.
+        body_requests.do(
+            ('localcache', self.location, name, etag),
+            lambda: self._fill(name, full_path, etag_path, etag),
+        )
+        self._evict(keep=name)
+        return full_path
+
+    def is_cached(self, name):
+        """
+        Tell whether a local copy of the file exists, without checking whether it's up to date.
+        """
+        return os.path.exists(self._get_cache_path(self.etags_location, name))
+
+    def clear(self, name):
+        """
+        Remove the local copy of a file.
+        """
+        try:
+            size = os.stat(self._get_cache_path(self.files_location, name)).st_size
+        except FileNotFoundError:
+            size = 0
+
+        for location in (self.etags_location, self.files_location):
+            try:
+                os.remove(self._get_cache_path(location, name))
+            except FileNotFoundError:
+                pass
+        self._update_size(-size)
+
+    def _get_cache_path(self, location, name):
+        path = os.path.abspath(os.path.join(location, name))
+        if os.path.commonpath([location, path]) != location:
+            raise ValueError(f"The file name is outside the cache: {name}")
+        return path
+
+    @staticmethod
+    def _read_etag(etag_path):
+        try:
+            with open(etag_path) as f:
+                return json.load(f)['etag']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _fill(self, name, full_path, etag_path, etag):
+        # Download into a temporary file first, so other threads and processes never see a partial file.
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        os.makedirs(os.path.dirname(etag_path), exist_ok=True)
+
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(full_path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'w+b') as file:
+                size = self._download(name, file)
+            try:
+                old_size = os.stat(full_path).st_size
+            except FileNotFoundError:
+                old_size = 0
+            os.replace(temp_path, full_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        self._update_size(size - old_size)
+
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(etag_path), prefix='.tmp-')
+        with os.fdopen(fd, 'w') as file:
+            json.dump({'etag': etag, 'size': size}, file)
+        os.replace(temp_path, etag_path)
+
+    def _download(self, name, file):
+        download = getattr(self.storage, 'download', None)
+        if download is not None:
+            # Fetches byte ranges in parallel (e.g. MinIO).
+            return download(name, file)
+
+        with self.storage.open(name, 'rb') as remote_file:
+            shutil.copyfileobj(remote_file, file, COPY_CHUNK_SIZE)
+            return file.tell()
+
+    def _update_size(self, delta):
+        with self._lock:
+            if self._total_size is not None:
+                self._total_size = max(0, self._total_size + delta)
+
+    def _evict(self, keep=None):
+        """
+        Remove the least recently used files, until the cache fits in ``max_size`` again.
+        The file that was just downloaded (``keep``) is not removed.
+        """
+        with self._lock:
+            if self._total_size is None:
+                self._total_size = sum(size for last_used, name, size in self._get_entries())
+            if self._total_size <= self.max_size:
+                return
+
+            # Only walk the cache when it's too large. This also counts the files of other processes.
+            entries = sorted(self._get_entries())
+            self._total_size = sum(size for last_used, name, size in entries)
+            for last_used, name, size in entries:
+                if self._total_size <= self.max_size:
+                    break
+                if name != keep:
+                    self.clear(name)
+
+    def _get_entries(self):
+        # Return the (last_used, name, size) of all cached files.
+        for root, dirs, files in os.walk(self.etags_location):
+            for filename in files:
+                if filename.startswith('.tmp-'):
+                    continue
+                etag_path = os.path.join(root, filename)
+                name = os.path.relpath(etag_path, self.etags_location)
+                try:
+                    last_used = os.stat(etag_path).st_mtime
+                    size = os.stat(self._get_cache_path(self.files_location, name)).st_size
+                except FileNotFoundError:
+                    continue
+                yield last_used, name, size
+
+    def _open(self, name, mode='rb'):
+        try:
+            path = self.path(name)
+        except NotImplementedError:
+            return self.storage.open(name, mode)
+        return File(open(path, mode))
+
+    def open_range(self, name, start, end):
+        """
+        Open the file for reading, positioned at byte ``start``.
+        Files that are not cached use a ranged request when the remote storage supports it.
+        """
+        try:
+            path = self.path(name)
+        except NotImplementedError:
+            open_range = getattr(self.storage, 'open_range', None)
+            if open_range is not None:
+                return open_range(name, start, end)
+            file = self.storage.open(name, 'rb')
+        else:
+            file = File(open(path, 'rb'))
+        file.seek(start)
+        return file
+
+    def _save(self, name, content):
+        name = self.storage.save(name, content)
+        self.clear(name)
+        return name
+
+    def delete(self, name):
+        self.storage.delete(name)
+        self.clear(name)
+
+    def exists(self, name):
+        return self.storage.exists(name)
+
+    def get_available_name(self, name, max_length=None):
+        return self.storage.get_available_name(name, max_length=max_length)
+
+    def get_valid_name(self, name):
+        return self.storage.get_valid_name(name)
+
+    def generate_filename(self, filename):
+        return self.storage.generate_filename(filename)
+
+    def listdir(self, path):
+        return self.storage.listdir(path)
+
+    def size(self, name):
+        return self.storage.size(name)
+
+    def url(self, name):
+        return self.storage.url(name)
+
+    def urls(self, names):
+        urls = getattr(self.storage, 'urls', None)
+        if urls is not None:
+            return urls(names)
+        return [self.storage.url(name) for name in names]
+
+    def get_accessed_time(self, name):
+        return self.storage.get_accessed_time(name)
+
+    def get_created_time(self, name):
+        return self.storage.get_created_time(name)
+
+    def get_modified_time(self, name):
+        return self.storage.get_modified_time(name)
+
+    def get_etag(self, name):
+        get_etag = getattr(self.storage, 'get_etag', None)
+        if get_etag is not None:
+            return get_etag(name)
+
+        mtime = int(self.storage.get_modified_time(name).timestamp() * 1000000)
+        return f'"{self.storage.size(name):x}-{mtime:x}"'
+
+    def stat(self, name):
+        """
+        Return the metadata of the remote file.
+        """
+        stat = getattr(self.storage, 'stat', None)
+        if stat is not None:
+            return stat(name)
+        elif not self.storage.exists(name):
+            return None
+        return {
+            'size': self.storage.size(name),
+            'etag': self.get_etag(name),
+        }
+
+    def presigned_url(self, name, *args, **kwargs):
+        return self.storage.presigned_url(name, *args, **kwargs)
@@ -1,4 +1,12 @@
+import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
 import minio
+import urllib3
+from minio.error import InvalidResponseError, S3Error
 
 try:
     from django.urls import reverse
@@ -7,13 +15,23 @@ except ImportError:
 
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
+from django.utils.timezone import make_naive
+from minio_storage.errors import minio_error
 from minio_storage.policy import Policy
 from minio_storage.storage import MinioStorage
 
 from private_storage import appconfig
+from private_storage.storage.utils import get_instrumented_pool_classes, reverse_file_urls
 
 _NoValue = object()
 
+DOWNLOAD_PART_SIZE = 16 * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# The MinIO clients (and their connection pools) that are shared between threads and storage instances.
+_shared_clients = {}
+_shared_clients_lock = threading.Lock()
+
 
 def default_setting(name, default=_NoValue):
     result = getattr(settings, name, default)
@@ -31,8 +49,24 @@ def private_or_default_setting(private_name, default_name, default_value=_NoValu
         return result
 
 
+class _ObjectBody:
+    """
+    The body of a ``get_object()`` call, which returns the connection to the pool on close.
+    """
+
+    def __init__(self, response):
+        self.response = response
+
+    def read(self, amt=None):
+        return self.response.read(amt)
+
+    def close(self):
+        self.response.close()
+        self.response.release_conn()
+
+
 class PrivateMinioStorage(MinioStorage):
-    def __init__(self):
+    def __init__(self, minio_client=None):
         endpoint = private_or_default_setting("MINIO_PRIVATE_STORAGE_ENDPOINT", "MINIO_STORAGE_ENDPOINT")
         access_key = private_or_default_setting("MINIO_PRIVATE_STORAGE_ACCESS_KEY", "MINIO_STORAGE_ACCESS_KEY")
         secret_key = private_or_default_setting("MINIO_PRIVATE_STORAGE_SECRET_KEY", "MINIO_STORAGE_SECRET_KEY")
@@ -72,10 +106,18 @@ class PrivateMinioStorage(MinioStorage):
             "MINIO_PRIVATE_STORAGE_OBJECT_METADATA", "MINIO_STORAGE_MEDIA_OBJECT_METADATA", None
         )
 
-        client = minio.Minio(endpoint, access_key=access_key, secret_key=secret_key, secure=secure)
+        # The connection pool, timeouts and retries of the shared client.
+        self.max_pool_connections = default_setting("MINIO_PRIVATE_STORAGE_MAX_POOL_CONNECTIONS", 10)
+        self.connect_timeout = default_setting("MINIO_PRIVATE_STORAGE_CONNECT_TIMEOUT", 300)
+        self.read_timeout = default_setting("MINIO_PRIVATE_STORAGE_READ_TIMEOUT", 300)
+        self.tcp_keepalive = default_setting("MINIO_PRIVATE_STORAGE_TCP_KEEPALIVE", False)
+        self.retries = default_setting("MINIO_PRIVATE_STORAGE_RETRIES", 5)
+
+        if minio_client is None:
+            minio_client = self._get_shared_client(endpoint, access_key, secret_key, secure)
 
         super().__init__(
-            client,
+            minio_client,
             bucket_name,
             auto_create_bucket=auto_create_bucket,
             auto_create_policy=auto_create_policy,
@@ -88,10 +130,197 @@ class PrivateMinioStorage(MinioStorage):
             object_metadata=object_metadata,
         )
 
+        # Used by the streaming server, see PRIVATE_STORAGE_STREAMING_CHUNK_SIZE
+        self.streaming_chunk_size = default_setting("MINIO_PRIVATE_STORAGE_STREAMING_CHUNK_SIZE", None)
+        self.streaming_read_ahead = default_setting("MINIO_PRIVATE_STORAGE_STREAMING_READ_AHEAD", None)
+
+        # Large objects are uploaded and downloaded in parts, using multiple threads.
+        self.part_size = default_setting("MINIO_PRIVATE_STORAGE_PART_SIZE", 0)
+        self.parallel_uploads = default_setting("MINIO_PRIVATE_STORAGE_PARALLEL_UPLOADS", 3)
+        self.parallel_downloads = default_setting("MINIO_PRIVATE_STORAGE_PARALLEL_DOWNLOADS", 3)
+
+    def _get_shared_client(self, endpoint, access_key, secret_key, secure):
+        key = (
+            endpoint, access_key, secret_key, secure, self.max_pool_connections,
+            self.connect_timeout, self.read_timeout, self.tcp_keepalive, repr(self.retries),
+        )
+        with _shared_clients_lock:
+            try:
+                return _shared_clients[key]
+            except KeyError:
+                pass
+
+            client = minio.Minio(
+                endpoint, access_key=access_key, secret_key=secret_key, secure=secure,
+                http_client=self.get_http_client(),
+            )
+            _shared_clients[key] = client
+            return client
+
+    def get_http_client(self):
+        """
+        Return the urllib3 ``PoolManager`` for the MinIO client, based on the ``MINIO_PRIVATE_STORAGE_...`` settings.
+        This uses the same defaults as the MinIO client.
+        """
+        import certifi  # installed with minio
+
+        retries = self.retries
+        if not isinstance(retries, urllib3.Retry):
+            retries = urllib3.Retry(total=retries, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504])
+
+        kwargs = {}
+        if self.tcp_keepalive:
+            kwargs['socket_options'] = urllib3.connection.HTTPConnection.default_socket_options + [
+                (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            ]
+
+        http_client = urllib3.PoolManager(
+            timeout=urllib3.Timeout(connect=self.connect_timeout, read=self.read_timeout),
+            maxsize=self.max_pool_connections,
+            cert_reqs='CERT_REQUIRED',
+            ca_certs=os.environ.get('SSL_CERT_FILE') or certifi.where(),
+            retries=retries,
+            **kwargs
+        )
+        http_client.pool_classes_by_scheme = get_instrumented_pool_classes(http_client.pool_classes_by_scheme)
+        return http_client
+
+    def _save(self, name, content):
+        # Same as MinioStorage._save(), with the part size and number of upload threads.
+        try:
+            if hasattr(content, "seek") and callable(content.seek):
+                content.seek(0)
+            content_size, content_type, sane_name = self._examine_file(name, content)
+            self.client.put_object(
+                self.bucket_name,
+                sane_name,
+                content,
+                content_size,
+                content_type,
+                metadata=self.object_metadata,
+                part_size=self.part_size,
+                num_parallel_uploads=self.parallel_uploads,
+            )
+            return sane_name
+        except InvalidResponseError as error:
+            raise minio_error(f"File {name} could not be saved", error) from error
+
+    def download(self, name, file):
+        """
+        Download the object into a seekable local file, e.g. a temporary file for processing.
+        Large objects are fetched as parallel byte ranges. Returns the size of the object.
+        """
+        object_name = self._sanitize_path(name)
+        info = self.client.stat_object(self.bucket_name, object_name)
+        part_size = self.part_size or DOWNLOAD_PART_SIZE
+        lock = threading.Lock()
+
+        def download_part(start):
+            # Make sure all parts are read from the same version of the object.
+            response = self.client.get_object(
+                self.bucket_name, object_name, offset=start, length=min(part_size, info.size - start),
+                request_headers={'If-Match': f'"{info.etag}"'},
+            )
+            try:
+                position = start
+                while True:
+                    chunk = response.read(DOWNLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    with lock:
+                        file.seek(position)
+                        file.write(chunk)
+                    position += len(chunk)
+            finally:
+                response.close()
+                response.release_conn()
+
+        starts = range(0, info.size, part_size)
+        if self.parallel_downloads > 1 and len(starts) > 1:
+            with ThreadPoolExecutor(max_workers=self.parallel_downloads) as executor:
+                list(executor.map(download_part, starts))
+        else:
+            for start in starts:
+                download_part(start)
+
+        file.seek(0)
+        return info.size
+
     def get_modified_time(self, name):
         return self.modified_time(name)
 
+    def presigned_url(self, name, expire=None, content_type=None, content_disposition=None):
+        """
+        Return a temporary URL to download the object directly from MinIO.
+        The ``Content-Type`` and ``Content-Disposition`` headers of that download can be overwritten.
+        """
+        response_headers = {}
+        if content_type:
+            response_headers['response-content-type'] = content_type
+        if content_disposition:
+            response_headers['response-content-disposition'] = content_disposition
+
+        kwargs = {}
+        if expire:
+            kwargs['expires'] = timedelta(seconds=expire)
+
+        return self.client.presigned_get_object(
+            self.bucket_name, self._sanitize_path(name), response_headers=response_headers or None, **kwargs
+        )
+
+    def get_etag(self, name):
+        """
+        Return the ETag that MinIO assigned to the object.
+        """
+        info = self.client.stat_object(self.bucket_name, self._sanitize_path(name))
+        return f'"{info.etag}"'
+
+    def stat(self, name):
+        """
+        Return all metadata of the object, using a single ``stat_object()`` call.
+        """
+        try:
+            info = self.client.stat_object(self.bucket_name, self._sanitize_path(name))
+        except S3Error as error:
+            if error.code in ('NoSuchKey', 'NoSuchObject'):
+                return None
+            raise
+
+        last_modified = info.last_modified
+        if last_modified is not None and not settings.USE_TZ:
+            last_modified = make_naive(last_modified)
+
+        return {
+            'size': info.size,
+            'modified_time': last_modified,
+            'content_type': info.content_type,
+            'etag': f'"{info.etag}"',
+        }
+
+    def open_range(self, name, start, end):
+        """
+        Open a byte range of the object, without downloading the whole object.
+        """
+        try:
+            response = self.client.get_object(
+                self.bucket_name, self._sanitize_path(name), offset=start, length=end - start + 1
+            )
+        except S3Error as error:
+            if error.code in ('NoSuchKey', 'NoSuchObject'):
+                raise FileNotFoundError(f"File does not exist: {name}")
+            raise
+        return _ObjectBody(response)
+
     def url(self, name: str, *args, **kwargs) -> str:
         if appconfig.PRIVATE_STORAGE_MINO_REVERSE_PROXY:
             return reverse('serve_private_file', kwargs={'path': name})
         return super().url(name, *args, **kwargs)
+
+    def urls(self, names):
+        """
+        Return the URLs of multiple files, e.g. to render a list of objects.
+        """
+        if appconfig.PRIVATE_STORAGE_MINO_REVERSE_PROXY:
+            return reverse_file_urls(names)
+        url = super().url
+        return [url(name) for name in names]
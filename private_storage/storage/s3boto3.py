@@ -1,13 +1,107 @@
+import base64
+import hashlib
+import hmac
+import threading
+from urllib.parse import quote, unquote, urlsplit
+
 try:
     from django.urls import reverse
 except ImportError:
     from django.core.urlresolvers import reverse
 
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
 from django.utils.deconstruct import deconstructible
+from django.utils.timezone import make_naive
 from storages.backends.s3boto3 import S3Boto3Storage
-from storages.utils import setting
+from storages.utils import clean_name, setting
 
 from private_storage import appconfig
+from private_storage.storage.utils import get_instrumented_pool_classes, reverse_file_urls
+
+# The boto3 clients (and their connection pools) that are shared between threads and storage instances.
+_shared_clients = {}
+_shared_clients_lock = threading.Lock()
+
+
+def get_url_signer(client, bucket_name, signed_url, key):
+    """
+    Return a function that signs the URLs of other keys, with the same parameters as ``signed_url``.
+    The signing key, timestamp and expiry are reused, so each URL only needs one HMAC.
+    Both SigV4 and the older SigV2 query authentication are supported, otherwise ``None`` is returned.
+
+    botocore has no public API for this, so this is done on a best effort basis:
+    the signer is only used when it reproduces the signature of ``signed_url``.
+    """
+    credentials = getattr(getattr(client, '_request_signer', None), '_credentials', None)
+    if credentials is None:
+        return None
+    credentials = credentials.get_frozen_credentials()
+
+    url = urlsplit(signed_url)
+    quoted_key = quote(key, safe='/~')
+    if not key or not url.path.endswith(quoted_key):
+        return None
+    path_prefix = url.path[:-len(quoted_key)]
+    params = dict(param.split('=', 1) for param in url.query.split('&') if '=' in param)
+
+    if 'X-Amz-Signature' in params:
+        sign_path = _get_sigv4_signer(credentials, url, params)
+    elif 'Signature' in params:
+        sign_path = _get_sigv2_signer(credentials, bucket_name, url, params)
+    else:
+        return None
+
+    if sign_path is None or sign_path(url.path) != signed_url:
+        return None
+    return lambda key: sign_path(path_prefix + quote(key, safe='/~'))
+
+
+def _get_sigv4_signer(credentials, url, params):
+    if params.get('X-Amz-Algorithm') != 'AWS4-HMAC-SHA256' or params.get('X-Amz-SignedHeaders') != 'host':
+        return None
+
+    # The credential is quoted as "AKID%2Fdate%2Fregion%2Fs3%2Faws4_request".
+    access_key, *scope = unquote(params['X-Amz-Credential']).split('/')
+    if access_key != credentials.access_key or len(scope) != 4:
+        return None
+
+    signing_key = ('AWS4' + credentials.secret_key).encode('utf-8')
+    for part in scope:
+        signing_key = hmac.new(signing_key, part.encode('utf-8'), hashlib.sha256).digest()
+
+    query = url.query.rpartition('&X-Amz-Signature=')[0]
+    canonical_query = '&'.join(sorted(query.split('&')))
+    string_to_sign_prefix = 'AWS4-HMAC-SHA256\n{}\n{}\n'.format(params['X-Amz-Date'], '/'.join(scope))
+
+    def sign_path(path):
+        canonical_request = f'GET\n{path}\n{canonical_query}\nhost:{url.netloc}\n\nhost\nUNSIGNED-PAYLOAD'
+        string_to_sign = string_to_sign_prefix + hashlib.sha256(canonical_request.encode('utf-8')).hexdigest()
+        signature = hmac.new(signing_key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+        return f'{url.scheme}://{url.netloc}{path}?{query}&X-Amz-Signature={signature}'
+
+    return sign_path
+
+
+def _get_sigv2_signer(credentials, bucket_name, url, params):
+    if unquote(params.get('AWSAccessKeyId', '')) != credentials.access_key or 'Expires' not in params:
+        return None
+
+    # The signed resource includes the bucket name, unless it's already part of the path.
+    bucket_prefix = '' if url.path.startswith(f'/{bucket_name}/') else f'/{bucket_name}'
+    secret_key = credentials.secret_key.encode('utf-8')
+    string_to_sign_prefix = 'GET\n\n\n{}\n{}'.format(params['Expires'], bucket_prefix)
+
+    def sign_path(path):
+        digest = hmac.new(secret_key, (string_to_sign_prefix + path).encode('utf-8'), hashlib.sha1).digest()
+        signature = quote(base64.b64encode(digest).decode('ascii'), safe='')
+        return (
+            f'{url.scheme}://{url.netloc}{path}'
+            f'?AWSAccessKeyId={params["AWSAccessKeyId"]}&Signature={signature}&Expires={params["Expires"]}'
+        )
+
+    return sign_path
 
 
 @deconstructible
@@ -41,6 +135,24 @@ class PrivateS3BotoStorage(S3Boto3Storage):
         self.endpoint_url = setting('AWS_PRIVATE_S3_ENDPOINT_URL', None)
         self.use_ssl = setting('AWS_PRIVATE_S3_USE_SSL', True)
 
+        # Used by the streaming server, see PRIVATE_STORAGE_STREAMING_CHUNK_SIZE
+        self.streaming_chunk_size = setting('AWS_PRIVATE_STREAMING_CHUNK_SIZE', None)
+        self.streaming_read_ahead = setting('AWS_PRIVATE_STREAMING_READ_AHEAD', None)
+
+        # Multipart uploads of large files, used when files are saved.
+        self.multipart_threshold = setting('AWS_PRIVATE_MULTIPART_THRESHOLD', None)
+        self.multipart_chunksize = setting('AWS_PRIVATE_MULTIPART_CHUNKSIZE', None)
+        self.multipart_concurrency = setting('AWS_PRIVATE_MULTIPART_CONCURRENCY', None)
+        self.transfer_config = setting('AWS_PRIVATE_S3_TRANSFER_CONFIG', None) or self.get_transfer_config()
+
+        # The connection pool, timeouts and retries of the shared client.
+        self.max_pool_connections = setting('AWS_PRIVATE_S3_MAX_POOL_CONNECTIONS', None)
+        self.connect_timeout = setting('AWS_PRIVATE_S3_CONNECT_TIMEOUT', None)
+        self.read_timeout = setting('AWS_PRIVATE_S3_READ_TIMEOUT', None)
+        self.tcp_keepalive = setting('AWS_PRIVATE_S3_TCP_KEEPALIVE', None)
+        self.retries = setting('AWS_PRIVATE_S3_RETRIES', None)
+        self.client_config = setting('AWS_PRIVATE_S3_CLIENT_CONFIG', None) or self.get_client_config()
+
         # default settings used to be class attributes on S3Boto3Storage, but
         # are now part of the initialization or moved to a dictionary
         self.access_key = setting('AWS_PRIVATE_S3_ACCESS_KEY_ID', setting('AWS_PRIVATE_ACCESS_KEY_ID', self.access_key))
@@ -55,6 +167,86 @@ class PrivateS3BotoStorage(S3Boto3Storage):
             self.url_protocol = setting('AWS_PRIVATE_S3_URL_PROTOCOL', self.url_protocol)
             self.region_name = setting('AWS_PRIVATE_S3_REGION_NAME', self.region_name)
 
+    def get_transfer_config(self):
+        """
+        Return the boto3 ``TransferConfig`` for uploads.
+        Files above the threshold are uploaded in parts, using a pool of threads.
+        Failed parts are retried by botocore, and the multipart upload is aborted when it fails.
+        """
+        options = {
+            'multipart_threshold': self.multipart_threshold,
+            'multipart_chunksize': self.multipart_chunksize,
+            'max_concurrency': self.multipart_concurrency,
+        }
+        options = {key: value for key, value in options.items() if value is not None}
+
+        # Older django-storages versions don't have the use_threads setting.
+        return TransferConfig(use_threads=getattr(self, 'use_threads', True), **options)
+
+    def get_client_config(self):
+        """
+        Return the botocore ``Config`` of the client, based on the ``AWS_PRIVATE_...`` settings.
+        """
+        max_pool_connections = self.max_pool_connections
+        if self.multipart_concurrency and self.multipart_concurrency > (max_pool_connections or 10):
+            # Each upload thread needs its own connection, otherwise parts wait for the pool.
+            max_pool_connections = self.multipart_concurrency
+
+        options = {
+            'max_pool_connections': max_pool_connections,
+            'connect_timeout': self.connect_timeout,
+            'read_timeout': self.read_timeout,
+            'tcp_keepalive': self.tcp_keepalive,
+            'retries': self.retries,
+        }
+        return Config(
+            s3={'addressing_style': self.addressing_style},
+            signature_version=self.signature_version,
+            proxies=self.proxies,
+            **{key: value for key, value in options.items() if value is not None}
+        )
+
+    @property
+    def connection(self):
+        # boto3 resources are not thread-safe, but clients are.
+        # Each thread has its own resource, which all use the same client and connection pool.
+        connection = getattr(self._connections, 'connection', None)
+        if connection is None:
+            client, resource_class = self._get_shared_client()
+            connection = self._connections.connection = resource_class(client=client)
+        return connection
+
+    def _get_shared_client(self):
+        key = (
+            self.session_profile, self.access_key, self.secret_key, self.security_token,
+            self.region_name, self.use_ssl, self.endpoint_url, self.verify,
+            repr(sorted(vars(self.client_config).items())),
+        )
+        with _shared_clients_lock:
+            try:
+                return _shared_clients[key]
+            except KeyError:
+                pass
+
+            resource = self._create_session().resource(
+                's3',
+                region_name=self.region_name,
+                use_ssl=self.use_ssl,
+                endpoint_url=self.endpoint_url,
+                config=self.client_config,
+                verify=self.verify,
+            )
+            client = resource.meta.client
+
+            # botocore has no public API to reach its connection pools, so this is done on a best effort basis.
+            http_session = getattr(client._endpoint, 'http_session', None)
+            pool_classes_by_scheme = getattr(http_session, '_pool_classes_by_scheme', None)
+            if pool_classes_by_scheme is not None:
+                pool_classes_by_scheme.update(get_instrumented_pool_classes(pool_classes_by_scheme))
+
+            _shared_clients[key] = client, type(resource)
+            return _shared_clients[key]
+
     def url(self, name, *args, **kwargs):
         if appconfig.PRIVATE_STORAGE_S3_REVERSE_PROXY or not self.querystring_auth:
             # There is no direct URL possible, return our streaming view instead.
@@ -63,6 +255,96 @@ class PrivateS3BotoStorage(S3Boto3Storage):
             # The S3Boto3Storage can generate a presigned URL that is temporary available.
             return super().url(name, *args, **kwargs)
 
+    def urls(self, names, expire=None):
+        """
+        Return the URLs of multiple files, e.g. to render a list of objects.
+
+        Only the first URL is signed by botocore. The other URLs reuse its endpoint,
+        timestamp and signing key, so each URL only needs one HMAC.
+        """
+        if appconfig.PRIVATE_STORAGE_S3_REVERSE_PROXY or not self.querystring_auth:
+            return reverse_file_urls(names)
+        elif self.custom_domain:
+            return [self.url(name, expire=expire) for name in names]
+        elif not names:
+            return []
+
+        client = self.connection.meta.client
+        bucket_name = self.bucket_name
+        if expire is None:
+            expire = self.querystring_expire
+
+        def generate_presigned_url(key):
+            return client.generate_presigned_url(
+                'get_object', Params={'Bucket': bucket_name, 'Key': key}, ExpiresIn=expire
+            )
+
+        keys = [self._normalize_name(clean_name(name)) for name in names]
+        first_url = generate_presigned_url(keys[0])
+        sign_url = get_url_signer(client, bucket_name, first_url, keys[0]) or generate_presigned_url
+        return [first_url] + [sign_url(key) for key in keys[1:]]
+
+    def presigned_url(self, name, expire=None, content_type=None, content_disposition=None):
+        """
+        Return a temporary URL to download the object directly from S3.
+        The ``Content-Type`` and ``Content-Disposition`` headers of that download can be overwritten.
+        """
+        params = {
+            'Bucket': self.bucket_name,
+            'Key': self._normalize_name(clean_name(name)),
+        }
+        if content_type:
+            params['ResponseContentType'] = content_type
+        if content_disposition:
+            params['ResponseContentDisposition'] = content_disposition
+
+        return self.connection.meta.client.generate_presigned_url(
+            'get_object', Params=params, ExpiresIn=expire or self.querystring_expire
+        )
+
+    def get_etag(self, name):
+        """
+        Return the ETag that S3 assigned to the object.
+        """
+        name = self._normalize_name(clean_name(name))
+        return self.bucket.Object(name).e_tag
+
+    def stat(self, name):
+        """
+        Return all metadata of the object, using a single HEAD request.
+        """
+        name = self._normalize_name(clean_name(name))
+        try:
+            head = self.connection.meta.client.head_object(Bucket=self.bucket_name, Key=name)
+        except ClientError as err:
+            if err.response['ResponseMetadata']['HTTPStatusCode'] == 404:
+                return None
+            raise
+
+        last_modified = head['LastModified']
+        if not setting('USE_TZ'):
+            last_modified = make_naive(last_modified)
+
+        return {
+            'size': head['ContentLength'],
+            'modified_time': last_modified,
+            'content_type': head.get('ContentType'),
+            'etag': head.get('ETag'),
+        }
+
+    def open_range(self, name, start, end):
+        """
+        Open a byte range of the object.
+        This does a ranged GET, instead of downloading the whole object like :meth:`open` does.
+        """
+        name = self._normalize_name(clean_name(name))
+        try:
+            return self.bucket.Object(name).get(Range=f'bytes={start}-{end}')['Body']
+        except ClientError as err:
+            if err.response['ResponseMetadata']['HTTPStatusCode'] == 404:
+                raise FileNotFoundError(f"File does not exist: {name}")
+            raise
+
 
 @deconstructible
 class PrivateEncryptedS3BotoStorage(PrivateS3BotoStorage):
@@ -76,3 +358,5 @@ class PrivateEncryptedS3BotoStorage(PrivateS3BotoStorage):
     def __init__(self, **settings):
         super().__init__(**settings)
         self.signature_version = self.signature_version or 's3v4'
+        if not setting('AWS_PRIVATE_S3_CLIENT_CONFIG', None):
+            self.client_config = self.get_client_config()
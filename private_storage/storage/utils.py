@@ -0,0 +1,61 @@
+"""
+Helpers shared by the storage classes.
+"""
+import time
+from urllib.parse import quote
+
+from django.urls import reverse
+from django.utils.http import RFC3986_SUBDELIMS, escape_leading_slashes
+
+from private_storage import signals
+
+_instrumented_pool_classes = {}
+
+
+def reverse_file_urls(names):
+    """
+    Return the URLs of the ``serve_private_file`` view for multiple files.
+    The URL resolver is only used once, which makes this faster than calling ``reverse()`` for every file.
+    """
+    prefix = reverse('serve_private_file', kwargs={'path': ''})
+    # Same quoting as reverse() does.
+    safe = RFC3986_SUBDELIMS + '/~:@'
+    return [escape_leading_slashes(prefix + quote(name, safe=safe)) for name in names]
+
+
+def get_instrumented_pool_classes(pool_classes_by_scheme):
+    """
+    Return the urllib3 connection pool classes of a ``PoolManager``,
+    with subclasses that send the :data:`~private_storage.signals.connection_pool_wait` signal.
+    """
+    return {
+        scheme: _get_instrumented_pool_class(pool_class) for scheme, pool_class in pool_classes_by_scheme.items()
+    }
+
+
+def _get_instrumented_pool_class(pool_class):
+    try:
+        return _instrumented_pool_classes[pool_class]
+    except KeyError:
+        pass
+
+    class InstrumentedConnectionPool(pool_class):
+        def _get_conn(self, *args, **kwargs):
+            if not signals.connection_pool_wait.has_listeners():
+                return super()._get_conn(*args, **kwargs)
+
+            num_connections = self.num_connections
+            start = time.perf_counter()
+            conn = super()._get_conn(*args, **kwargs)
+            signals.connection_pool_wait.send(
+                sender=pool_class,
+                host=self.host,
+                wait=time.perf_counter() - start,
+                new_connection=self.num_connections > num_connections,
+            )
+            return conn
+
+    InstrumentedConnectionPool.__name__ = f'Instrumented{pool_class.__name__}'
+    InstrumentedConnectionPool.__qualname__ = InstrumentedConnectionPool.__name__
+    _instrumented_pool_classes[pool_class] = InstrumentedConnectionPool
+    return InstrumentedConnectionPool
@@ -0,0 +1,329 @@
+"""
+Iterators to send (parts of) a file in the response body.
+"""
+import mmap
+import queue
+import threading
+import time
+import zipfile
+
+from django.core.files.base import File
+
+from . import appconfig
+
+try:
+    from asgiref.sync import sync_to_async
+except ImportError:  # Django < 3.0
+    sync_to_async = None
+
+
+def get_chunk_size(private_file):
+    """
+    Return the number of bytes to read at once, which the storage may override.
+    """
+    chunk_size = getattr(private_file.storage, 'streaming_chunk_size', None)
+    return chunk_size or appconfig.PRIVATE_STORAGE_STREAMING_CHUNK_SIZE
+
+
+def get_read_ahead(private_file):
+    """
+    Return the number of chunks to read ahead, which the storage may override.
+    """
+    read_ahead = getattr(private_file.storage, 'streaming_read_ahead', None)
+    return appconfig.PRIVATE_STORAGE_STREAMING_READ_AHEAD if read_ahead is None else read_ahead
+
+
+def iter_file_range(private_file, start, end, chunk_size=File.DEFAULT_CHUNK_SIZE):
+    """
+    Yield the bytes ``start`` up to and including ``end`` of the file.
+    The file is only opened once the iteration starts.
+    """
+    if end < start:
+        return
+
+    file = private_file.open_range(start, end)
+    try:
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = file.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+async def aiter_file_range(private_file, start, end, chunk_size=File.DEFAULT_CHUNK_SIZE):
+    """
+    Async version of :func:`iter_file_range`.
+    Each blocking call runs in the thread pool, so threads are only used while a chunk is read.
+    """
+    if end < start:
+        return
+
+    file = await sync_to_async(private_file.open_range, thread_sensitive=False)(start, end)
+    try:
+        read = sync_to_async(file.read, thread_sensitive=False)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        await sync_to_async(file.close, thread_sensitive=False)()
+
+
+def iter_mmap_range(path, start, end, chunk_size=File.DEFAULT_CHUNK_SIZE):
+    """
+    Yield the bytes ``start`` up to and including ``end`` of a local file.
+    The file is memory mapped, so no ``read()`` calls are made. Each chunk is still copied into a new ``bytes`` object.
+    """
+    if end < start:
+        return
+
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        if hasattr(mapped, 'madvise'):  # Python 3.8+, not on Windows
+            mapped.madvise(mmap.MADV_SEQUENTIAL)
+        end = min(end, len(mapped) - 1)
+        for offset in range(start, end + 1, chunk_size):
+            yield mapped[offset:min(offset + chunk_size, end + 1)]
+
+
+async def aiter_mmap_range(path, start, end, chunk_size=File.DEFAULT_CHUNK_SIZE):
+    """
+    Async version of :func:`iter_mmap_range`.
+    The chunks are copied in the thread pool, as reading pages that are not cached yet blocks.
+    """
+    chunks = iter_mmap_range(path, start, end, chunk_size)
+    next_chunk = sync_to_async(next, thread_sensitive=False)
+    try:
+        while True:
+            chunk = await next_chunk(chunks, None)
+            if chunk is None:
+                break
+            yield chunk
+    finally:
+        await sync_to_async(chunks.close, thread_sensitive=False)()
+
+
+def _get_multipart_headers(private_file, ranges, boundary):
+    part_headers = [
+        "--{boundary}\r\nContent-Type: {content_type}\r\nContent-Range: bytes {start}-{end}/{size}\r\n\r\n".format(
+            boundary=boundary,
+            content_type=private_file.content_type,
+            start=start,
+            end=end,
+            size=private_file.size,
+        ).encode('ascii')
+        for start, end in ranges
+    ]
+    trailer = f"--{boundary}--\r\n".encode('ascii')
+
+    # Each part is followed by a CRLF before the next boundary.
+    content_length = len(trailer) + sum(
+        len(header) + (end - start + 1) + 2 for header, (start, end) in zip(part_headers, ranges)
+    )
+    return part_headers, trailer, content_length
+
+
+def multipart_byteranges(private_file, ranges, boundary, chunk_size=File.DEFAULT_CHUNK_SIZE):
+    """
+    Build a ``multipart/byteranges`` body for multiple ranges.
+    This returns the total content length, and the iterator that generates the body.
+    """
+    part_headers, trailer, content_length = _get_multipart_headers(private_file, ranges, boundary)
+
+    def _iter():
+        for header, (start, end) in zip(part_headers, ranges):
+            yield header
+            yield from iter_file_range(private_file, start, end, chunk_size=chunk_size)
+            yield b'\r\n'
+        yield trailer
+
+    return content_length, _iter()
+
+
+def amultipart_byteranges(private_file, ranges, boundary, chunk_size=File.DEFAULT_CHUNK_SIZE):
+    """
+    Async version of :func:`multipart_byteranges`.
+    """
+    part_headers, trailer, content_length = _get_multipart_headers(private_file, ranges, boundary)
+
+    async def _aiter():
+        for header, (start, end) in zip(part_headers, ranges):
+            yield header
+            async for chunk in aiter_file_range(private_file, start, end, chunk_size=chunk_size):
+                yield chunk
+            yield b'\r\n'
+        yield trailer
+
+    return content_length, _aiter()
+
+
+def iter_measured(iterator, callback):
+    """
+    Yield the chunks of the iterator, and count the bytes.
+    Afterwards, or when the client disconnected, ``callback(bytes_sent, first_byte_time)`` is called.
+    """
+    bytes_sent = 0
+    first_byte_time = None
+    try:
+        for chunk in iterator:
+            if first_byte_time is None:
+                first_byte_time = time.perf_counter()
+            bytes_sent += len(chunk)
+            yield chunk
+    finally:
+        callback(bytes_sent, first_byte_time)
+
+
+async def aiter_measured(iterator, callback):
+    """
+    Async version of :func:`iter_measured`.
+    """
+    bytes_sent = 0
+    first_byte_time = None
+    try:
+        async for chunk in iterator:
+            if first_byte_time is None:
+                first_byte_time = time.perf_counter()
+            bytes_sent += len(chunk)
+            yield chunk
+    finally:
+        callback(bytes_sent, first_byte_time)
+
+
+class _ZipBuffer:
+    """
+    Write-only file object for :class:`zipfile.ZipFile`, which collects the output until it's sent.
+    As this object is not seekable, the ZIP file is written with data descriptors.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_zip(entries, chunk_size=File.DEFAULT_CHUNK_SIZE):
+    """
+    Generate a ZIP64 archive on the fly, without using a temporary file.
+    The ``entries`` are ``(arcname, private_file, compress_type)`` tuples.
+    Only a single chunk of each file is kept in memory.
+    """
+    buffer = _ZipBuffer()
+    with zipfile.ZipFile(buffer, mode='w', allowZip64=True) as archive:
+        for arcname, private_file, compress_type in entries:
+            # ZIP files can't store dates before 1980.
+            date_time = max(private_file.modified_time.timetuple()[:6], (1980, 1, 1, 0, 0, 0))
+            info = zipfile.ZipInfo(arcname, date_time=date_time)
+            info.compress_type = compress_type
+            info.external_attr = 0o644 << 16
+
+            with archive.open(info, mode='w', force_zip64=True) as dest:
+                for chunk in iter_file_range(private_file, 0, private_file.size - 1, chunk_size=chunk_size):
+                    dest.write(chunk)
+                    data = buffer.pop()
+                    if data:
+                        yield data
+
+            # The remaining compressed data and data descriptor
+            yield buffer.pop()
+
+    # The central directory
+    yield buffer.pop()
+
+
+class _ReadError:
+    def __init__(self, exception):
+        self.exception = exception
+
+
+_END = object()
+
+
+class ReadAheadIterator:
+    """
+    Read the next chunks in a background thread, while the current chunk is being sent.
+
+    This overlaps reading from the storage with writing to the client,
+    which helps when each read has a high latency (e.g. reading from S3).
+    At most ``size`` chunks are buffered.
+    """
+
+    def __init__(self, iterator, size):
+        self._iterator = iterator
+        self._queue = queue.Queue(maxsize=size)
+        self._stopped = threading.Event()
+        self._thread = None
+        self._finished = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._finished:
+            raise StopIteration
+
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._read_chunks, daemon=True)
+            self._thread.start()
+
+        item = self._queue.get()
+        if item is _END:
+            self._finished = True
+            raise StopIteration
+        elif isinstance(item, _ReadError):
+            self._finished = True
+            raise item.exception
+        return item
+
+    def close(self):
+        """
+        Stop reading, e.g. when the client disconnected.
+        """
+        self._finished = True
+        self._stopped.set()
+        if self._thread is None:
+            # The iterator is not in use by the thread, so it can be closed here.
+            close = getattr(self._iterator, 'close', None)
+            if close is not None:
+                close()
+
+    def _read_chunks(self):
+        try:
+            for chunk in self._iterator:
+                if not self._put(chunk):
+                    break
+        except Exception as e:
+            self._put(_ReadError(e))
+        else:
+            self._put(_END)
+        finally:
+            close = getattr(self._iterator, 'close', None)
+            if close is not None:
+                close()
+
+    def _put(self, item):
+        # Wait until there is room in the buffer, unless the response is closed.
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+            except queue.Full:
+                continue
+            else:
+                return True
+        return False
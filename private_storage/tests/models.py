@@ -39,3 +39,36 @@ class CustomerDossierJoin(models.Model):
 
     customer = models.CharField(max_length=100)
     file = PrivateFileField(upload_to='CustomerDossierJoin', upload_subfolder=upload_subfolder2)
+
+
+class AttachmentsDossier(models.Model):
+    customer = models.CharField(max_length=100)
+    file1 = PrivateFileField(upload_to='AttachmentsDossier')
+    file2 = PrivateFileField(upload_to='AttachmentsDossier', blank=True)
+    file3 = PrivateFileField(upload_to='AttachmentsDossier/sub', blank=True)
+
+    def __str__(self):
+        return self.customer
+
+
+class RestrictedDossier(models.Model):
+    file = PrivateFileField(content_types=('application/pdf', 'image/png'), max_file_size=1000)
+
+
+class DeduplicatedDossier(models.Model):
+    file = PrivateFileField(upload_to='DeduplicatedDossier', deduplicate=True)
+
+
+class MetadataDossier(models.Model):
+    file = PrivateFileField(
+        upload_to='MetadataDossier',
+        size_field='file_size',
+        content_type_field='file_content_type',
+        modified_time_field='file_modified',
+        checksum_field='file_checksum',
+        blank=True,
+    )
+    file_size = models.BigIntegerField(null=True, blank=True)
+    file_content_type = models.CharField(max_length=100, blank=True, null=True)
+    file_modified = models.DateTimeField(null=True, blank=True)
+    file_checksum = models.CharField(max_length=64, blank=True, null=True)
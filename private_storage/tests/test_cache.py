@@ -0,0 +1,182 @@
+import threading
+import time
+from unittest import mock
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory, SimpleTestCase
+
+from private_storage import appconfig
+from private_storage.cache import get_permission, invalidate_permissions
+from private_storage.models import PrivateFile
+from private_storage.singleflight import SingleFlight
+from private_storage.storage import private_storage
+from private_storage.tests.models import SimpleDossier
+from private_storage.tests.utils import PrivateFileTestCase
+from private_storage.views import PrivateStorageView
+
+
+@mock.patch.object(appconfig, 'PRIVATE_STORAGE_METADATA_CACHE', 'default')
+class MetadataCacheTests(PrivateFileTestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def get_private_file(self, name):
+        return PrivateFile(RequestFactory().get('/'), private_storage, name)
+
+    def test_metadata_cache(self):
+        obj = SimpleDossier.objects.create(file=SimpleUploadedFile('cache1.txt', b'cache1'))
+        self.assertTrue(self.get_private_file(obj.file.name).exists())
+
+        with mock.patch.object(private_storage, 'stat') as stat:
+            private_file = self.get_private_file(obj.file.name)
+            self.assertTrue(private_file.exists())
+            self.assertEqual(private_file.size, 6)
+            stat.assert_not_called()
+
+        # Deleting through the field clears the cache.
+        name = obj.file.name
+        obj.file.delete()
+        self.assertFalse(self.get_private_file(name).exists())
+
+    def test_missing_file_cache(self):
+        self.assertFalse(self.get_private_file('cache2.txt').exists())
+        with mock.patch.object(private_storage, 'stat') as stat:
+            self.assertFalse(self.get_private_file('cache2.txt').exists())
+            stat.assert_not_called()
+
+        # Saving through the field clears the cache.
+        obj = SimpleDossier()
+        obj.file.save('cache2.txt', SimpleUploadedFile('cache2.txt', b'cache2'))
+        self.assertEqual(obj.file.name, 'cache2.txt')
+        self.assertTrue(self.get_private_file('cache2.txt').exists())
+
+
+@mock.patch.object(appconfig, 'PRIVATE_STORAGE_PERMISSION_CACHE', 'default')
+class PermissionCacheTests(PrivateFileTestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = User.objects.create_user('user', 'user@example.com', 'user')
+
+    def get_private_file(self, name, user):
+        request = RequestFactory().get('/')
+        request.user = user
+        return PrivateFile(request, private_storage, name)
+
+    def test_permission_cache(self):
+        check = mock.Mock(return_value=False)
+        for _ in range(3):
+            self.assertFalse(get_permission(self.get_private_file('perm1.txt', self.user), check))
+        self.assertEqual(check.call_count, 1)
+
+        # Other files, users and scopes are checked separately.
+        other_user = User.objects.create_user('other', 'other@example.com', 'other')
+        get_permission(self.get_private_file('perm2.txt', self.user), check)
+        get_permission(self.get_private_file('perm1.txt', other_user), check)
+        get_permission(self.get_private_file('perm1.txt', self.user), check, scope='OtherView')
+        self.assertEqual(check.call_count, 4)
+
+    def test_view_access_functions(self):
+        """
+        Views with a different access function don't share the cached decisions.
+        """
+        obj = SimpleDossier.objects.create(file=SimpleUploadedFile('perm3.txt', b'perm3'))
+
+        def get(**initkwargs):
+            request = RequestFactory().get('/')
+            request.user = self.user
+            return PrivateStorageView.as_view(**initkwargs)(request, path=obj.file.name)
+
+        for allow, deny in [(allow_access, deny_access), (lambda pf: True, lambda pf: False)]:
+            cache.clear()
+            response = get(can_access_file=allow)
+            self.assertEqual(response.status_code, 200)
+            response.close()
+            with self.assertRaises(PermissionDenied):
+                get(can_access_file=deny)
+
+    def test_anonymous_not_cached(self):
+        check = mock.Mock(return_value=True)
+        get_permission(self.get_private_file('perm1.txt', AnonymousUser()), check)
+        get_permission(self.get_private_file('perm1.txt', AnonymousUser()), check)
+        self.assertEqual(check.call_count, 2)
+
+    def test_invalidate_permissions(self):
+        check = mock.Mock(return_value=True)
+        get_permission(self.get_private_file('perm1.txt', self.user), check)
+
+        invalidate_permissions(user=self.user)
+        get_permission(self.get_private_file('perm1.txt', self.user), check)
+        self.assertEqual(check.call_count, 2)
+
+        invalidate_permissions(storage=private_storage, name='perm1.txt')
+        get_permission(self.get_private_file('perm1.txt', self.user), check)
+        self.assertEqual(check.call_count, 3)
+
+        invalidate_permissions()
+        get_permission(self.get_private_file('perm1.txt', self.user), check)
+        get_permission(self.get_private_file('perm1.txt', self.user), check)
+        self.assertEqual(check.call_count, 4)
+
+
+def allow_access(private_file):
+    return True
+
+
+def deny_access(private_file):
+    return False
+
+
+class SingleFlightTests(SimpleTestCase):
+
+    def test_coalesce_concurrent_calls(self):
+        single_flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return {'size': 1}
+
+        results = []
+
+        def request():
+            results.append(single_flight.do('file', fetch))
+
+        leader = threading.Thread(target=request)
+        leader.start()
+        started.wait(5)
+        followers = [threading.Thread(target=request) for _ in range(5)]
+        for thread in followers:
+            thread.start()
+        while single_flight.coalesced < 5:
+            time.sleep(0.001)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'size': 1}] * 6)
+
+        # Once finished, the next call fetches again.
+        self.assertEqual(single_flight.do('file', fetch), {'size': 1})
+        self.assertEqual(len(calls), 2)
+
+    def test_error(self):
+        single_flight = SingleFlight()
+
+        def fetch():
+            raise OSError("Bucket unavailable")
+
+        with self.assertRaises(OSError):
+            single_flight.do('file', fetch)
+        self.assertEqual(single_flight._calls, {})
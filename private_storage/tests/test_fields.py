@@ -0,0 +1,208 @@
+import datetime
+import hashlib
+from unittest import mock, skipUnless
+
+import botocore.auth
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils.functional import empty
+
+from private_storage import appconfig
+from private_storage.fields import PrivateFileField
+from private_storage.storage import LazyPrivateStorage
+from private_storage.storage.files import PrivateFileSystemStorage
+from private_storage.storage.s3boto3 import PrivateS3BotoStorage
+from private_storage.tests.models import DeduplicatedDossier, MetadataDossier, SimpleDossier
+from private_storage.tests.utils import PrivateFileTestCase
+from private_storage.views import PrivateStorageDetailView
+
+NAMES = ['dossier/file1.pdf', 'dossier/file 2.pdf', 'dossier/ünïcode #3.pdf']
+
+
+@override_settings(ROOT_URLCONF='private_storage.urls')
+class StorageUrlsTests(SimpleTestCase):
+
+    def test_filesystem_urls(self):
+        storage = PrivateFileSystemStorage()
+        names = NAMES + ['dossier/.hidden', 'dossier/./file4.pdf', 'dossier/../file5.pdf']
+        self.assertEqual(storage.urls(names), [storage.url(name) for name in names])
+
+    @mock.patch.object(appconfig, 'PRIVATE_STORAGE_S3_REVERSE_PROXY', True)
+    def test_s3_reverse_proxy_urls(self):
+        storage = PrivateS3BotoStorage()
+        self.assertEqual(storage.urls(NAMES), [reverse('serve_private_file', kwargs={'path': name}) for name in NAMES])
+
+    @override_settings(
+        AWS_PRIVATE_ACCESS_KEY_ID='AKIAEXAMPLE',
+        AWS_PRIVATE_SECRET_ACCESS_KEY='secret',
+        AWS_PRIVATE_S3_REGION_NAME='eu-west-1',
+    )
+    def test_s3_presigned_urls(self):
+        storage = PrivateS3BotoStorage()
+        urls = storage.urls(NAMES)
+        self.assertEqual(len(urls), 3)
+        # The signature contains the current time, so compare without the query string.
+        self.assertEqual(
+            [url.split('?')[0] for url in urls],
+            [storage.url(name).split('?')[0] for name in NAMES]
+        )
+
+    @override_settings(
+        AWS_PRIVATE_ACCESS_KEY_ID='AKIAEXAMPLE',
+        AWS_PRIVATE_SECRET_ACCESS_KEY='secret',
+        AWS_PRIVATE_S3_REGION_NAME='eu-west-1',
+    )
+    def test_s3_batch_signing(self):
+        """
+        The URLs that urls() signs itself are identical to the URLs botocore signs.
+        """
+        if not hasattr(botocore.auth, 'get_current_datetime'):
+            self.skipTest("Requires a newer botocore")
+
+        now = datetime.datetime(2024, 1, 1, 12, 0, 0)
+        for signature_version in ('s3', 's3v4'):
+            with self.settings(AWS_PRIVATE_S3_SIGNATURE_VERSION=signature_version), \
+                    mock.patch('botocore.auth.get_current_datetime', return_value=now), \
+                    mock.patch('time.time', return_value=now.timestamp()):
+                storage = PrivateS3BotoStorage()
+                client = storage.connection.meta.client
+                with mock.patch.object(client, 'generate_presigned_url', wraps=client.generate_presigned_url) as sign:
+                    urls = storage.urls(NAMES)
+                self.assertEqual(sign.call_count, 1)
+                self.assertEqual(urls, [
+                    client.generate_presigned_url('get_object', Params={'Bucket': 'foobar', 'Key': name}, ExpiresIn=3600)
+                    for name in NAMES
+                ])
+
+
+@override_settings(ROOT_URLCONF='private_storage.urls')
+class FieldUrlsTests(PrivateFileTestCase):
+
+    def test_prefetch_urls(self):
+        SimpleDossier.objects.create(file=SimpleUploadedFile('urls1.txt', b'urls1'))
+        SimpleDossier.objects.create(file=None)
+        SimpleDossier.objects.create(file=SimpleUploadedFile('urls2.txt', b'urls2'))
+        objects = list(SimpleDossier.objects.order_by('pk'))
+
+        field = SimpleDossier._meta.get_field('file')
+        self.assertEqual(field.get_urls(objects), ['/urls1.txt', None, '/urls2.txt'])
+
+        field.prefetch_urls(objects)
+        with mock.patch.object(field.storage, 'url') as url:
+            self.assertEqual(objects[0].file.url, '/urls1.txt')
+            self.assertEqual(objects[2].file.url, '/urls2.txt')
+            url.assert_not_called()
+
+
+class DeduplicateTests(PrivateFileTestCase):
+
+    def test_deduplicate(self):
+        content_hash = hashlib.sha256(b'dedup').hexdigest()
+        name = f'DeduplicatedDossier/{content_hash[:2]}/{content_hash[2:4]}/{content_hash}.txt'
+
+        obj1 = DeduplicatedDossier.objects.create(file=SimpleUploadedFile('first.TXT', b'dedup'))
+        obj2 = DeduplicatedDossier.objects.create(file=SimpleUploadedFile('second.txt', b'dedup'))
+        self.assertEqual(obj1.file.name, name)
+        self.assertEqual(obj2.file.name, name)
+        self.assertEqual(obj1.file.content_hash, content_hash)
+        self.assertExists(name)
+
+        # The blob is only removed when the last reference is deleted.
+        obj1.file.delete()
+        self.assertFalse(obj1.file)
+        self.assertExists(name)
+        obj2.file.delete()
+        self.assertFalse(obj2.file.storage.exists(name))
+
+    @skipUnless(hasattr(TestCase, 'captureOnCommitCallbacks'), "Requires Django 3.2")
+    def test_deduplicate_concurrent_delete(self):
+        """
+        When the reused blob is removed before the object is committed, it's stored again.
+        """
+        content_hash = hashlib.sha256(b'race').hexdigest()
+        name = f'DeduplicatedDossier/{content_hash[:2]}/{content_hash[2:4]}/{content_hash}.txt'
+        obj1 = DeduplicatedDossier.objects.create(file=SimpleUploadedFile('first.txt', b'race'))
+
+        with self.assertLogs('private_storage.fields', 'WARNING'), self.captureOnCommitCallbacks(execute=True):
+            obj2 = DeduplicatedDossier(file=SimpleUploadedFile('second.txt', b'race'))
+            obj2.file.save('second.txt', SimpleUploadedFile('second.txt', b'race'), save=False)
+            obj1.file.delete()  # obj2 is not saved yet, so the blob is removed.
+            self.assertFalse(obj2.file.storage.exists(name))
+            obj2.save()
+
+        self.assertEqual(obj2.file.name, name)
+        with obj2.file.storage.open(name) as file:
+            self.assertEqual(file.read(), b'race')
+
+    def test_deduplicate_upload_subfolder_check(self):
+        field = PrivateFileField(deduplicate=True, upload_subfolder=lambda instance: ['sub'])
+        field.set_attributes_from_name('file')
+        self.assertEqual([error.id for error in field._check_deduplicate()], ['private_storage.E001'])
+
+    def test_detail_view_etag(self):
+        obj = DeduplicatedDossier.objects.create(file=SimpleUploadedFile('etag.txt', b'etag'))
+        request = RequestFactory().get('/')
+        request.user = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+
+        view = PrivateStorageDetailView.as_view(model=DeduplicatedDossier)
+        response = view(request, pk=obj.pk)
+        self.assertEqual(response['ETag'], '"{}"'.format(hashlib.sha256(b'etag').hexdigest()))
+        response.close()
+
+
+class MetadataFieldsTests(PrivateFileTestCase):
+
+    def test_metadata_fields(self):
+        obj = MetadataDossier.objects.create(file=SimpleUploadedFile('report.pdf', b'%PDF-metadata'))
+        self.assertEqual(obj.file_size, 13)
+        self.assertEqual(obj.file_content_type, 'application/pdf')
+        self.assertIsNotNone(obj.file_modified)
+        self.assertEqual(obj.file_checksum, hashlib.sha256(b'%PDF-metadata').hexdigest())
+
+        obj.file.delete()
+        obj.refresh_from_db()
+        self.assertIsNone(obj.file_size)
+        self.assertIsNone(obj.file_content_type)
+        self.assertIsNone(obj.file_modified)
+        self.assertIsNone(obj.file_checksum)
+
+    def test_detail_view_skips_storage(self):
+        obj = MetadataDossier.objects.create(file=SimpleUploadedFile('report.pdf', b'%PDF-metadata'))
+        request = RequestFactory().get('/')
+        request.user = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+
+        storage = obj.file.storage
+        view = PrivateStorageDetailView.as_view(model=MetadataDossier)
+        with mock.patch.object(storage, 'stat') as stat, mock.patch.object(storage, 'exists') as exists:
+            response = view(request, pk=obj.pk)
+        stat.assert_not_called()
+        exists.assert_not_called()
+
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(response['Content-Length'], '13')
+        self.assertEqual(response['ETag'], f'"{obj.file_checksum}"')
+        self.assertEqual(b''.join(response.streaming_content), b'%PDF-metadata')
+        response.close()
+
+        # Without the modification time, the storage is still asked for it.
+        MetadataDossier.objects.filter(pk=obj.pk).update(file_modified=None)
+        with mock.patch.object(storage, 'stat', wraps=storage.stat) as stat:
+            response = view(request, pk=obj.pk)
+        stat.assert_called_once()
+        self.assertEqual(response['ETag'], f'"{obj.file_checksum}"')
+        response.close()
+
+
+class LazyStorageTests(SimpleTestCase):
+
+    def test_field_does_not_initialize_storage(self):
+        storage = LazyPrivateStorage()
+        with mock.patch('private_storage.fields.private_storage', storage):
+            field = PrivateFileField()
+        self.assertIs(field.storage, storage)
+        self.assertIs(storage._wrapped, empty)
+
+        self.assertIsInstance(field.storage.get_valid_name('file.pdf'), str)
+        self.assertIsNot(storage._wrapped, empty)
@@ -1,11 +1,29 @@
 # Most pathetic test case ever, see if all files are importable.
 import private_storage
 import private_storage.appconfig
+import private_storage.cache
 import private_storage.fields
+import private_storage.memorycache
 import private_storage.models
 import private_storage.permissions
 import private_storage.servers
+import private_storage.signals
+import private_storage.singleflight
 import private_storage.storage.files
+import private_storage.storage.localcache
 import private_storage.storage.s3boto3
+import private_storage.storage.utils
+import private_storage.streaming
+import private_storage.tokens
+import private_storage.uploadhandler
 import private_storage.urls
 import private_storage.views
+
+# The minio backend is an optional dependency, only import it when it's installed.
+try:
+    import minio
+    import minio_storage
+except ImportError:
+    pass
+else:
+    import private_storage.storage.minio
@@ -1,3 +1,5 @@
+from unittest import mock
+
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import RequestFactory, SimpleTestCase
 
@@ -36,3 +38,22 @@ class PrivateFileTests(SimpleTestCase):
         # Retrieving a FieldFile(none) should not give errors
         request = RequestFactory().get('/')
         self.assertFalse(PrivateFile(request, private_storage, None).exists())
+
+    def test_privatefile_stat(self):
+        # All metadata is fetched at once, and reused by the properties.
+        private_storage.save('stat-test.txt', SimpleUploadedFile('stat-test.txt', b'test10'))
+        try:
+            private_file = PrivateFile(RequestFactory().get('/'), private_storage, 'stat-test.txt')
+            self.assertTrue(private_file.exists())
+
+            with mock.patch.object(private_storage, 'size') as size, \
+                    mock.patch.object(private_storage, 'get_modified_time') as get_modified_time:
+                self.assertEqual(private_file.size, 6)
+                self.assertIsNotNone(private_file.modified_time)
+                self.assertTrue(private_file.etag.startswith('"6-'))
+                size.assert_not_called()
+                get_modified_time.assert_not_called()
+        finally:
+            private_storage.delete('stat-test.txt')
+
+        self.assertIsNone(PrivateFile(RequestFactory().get('/'), private_storage, 'stat-test.txt').stat())
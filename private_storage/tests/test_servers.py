@@ -0,0 +1,196 @@
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+
+from django.core.files.base import ContentFile
+from django.http import FileResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from private_storage.memorycache import memory_cache
+from private_storage.models import PrivateFile
+from private_storage.servers import MAX_RANGES, DjangoStreamingServer, NginxXAccelRedirectServer, get_server_class, \
+    parse_range_header
+from private_storage.storage.files import PrivateFileSystemStorage
+from private_storage.streaming import iter_mmap_range
+from private_storage.storage.s3boto3 import PrivateS3BotoStorage
+from private_storage.tests.utils import PrivateFileTestCase
+
+
+class RangeHeaderTests(SimpleTestCase):
+
+    def test_parse_range_header(self):
+        self.assertEqual(parse_range_header('bytes=0-499', 1000), [(0, 499)])
+        self.assertEqual(parse_range_header('bytes=500-', 1000), [(500, 999)])
+        self.assertEqual(parse_range_header('bytes=-200', 1000), [(800, 999)])
+        self.assertEqual(parse_range_header('bytes=0-0, 900-2000', 1000), [(0, 0), (900, 999)])
+
+    def test_parse_range_header_merge(self):
+        self.assertEqual(parse_range_header('bytes=500-600, 0-10, 550-700, 11-20', 1000), [(0, 20), (500, 700)])
+        self.assertEqual(parse_range_header(f'bytes={", ".join(["0-999"] * 5000)}', 1000), [(0, 999)])
+
+        # Too many ranges send the whole file.
+        many_ranges = ', '.join(f'{i * 10}-{i * 10 + 1}' for i in range(MAX_RANGES + 1))
+        self.assertIsNone(parse_range_header(f'bytes={many_ranges}', 1000))
+
+    def test_parse_range_header_unsatisfiable(self):
+        self.assertEqual(parse_range_header('bytes=1000-', 1000), [])
+        self.assertEqual(parse_range_header('bytes=-0', 1000), [])
+
+    def test_parse_range_header_invalid(self):
+        self.assertIsNone(parse_range_header(None, 1000))
+        self.assertIsNone(parse_range_header('items=0-1', 1000))
+        self.assertIsNone(parse_range_header('bytes=5-1', 1000))
+        self.assertIsNone(parse_range_header('bytes=a-b', 1000))
+
+
+class PresignedRedirectServerTests(SimpleTestCase):
+
+    @override_settings(
+        AWS_PRIVATE_ACCESS_KEY_ID='AKIAEXAMPLE',
+        AWS_PRIVATE_SECRET_ACCESS_KEY='secret',
+        AWS_PRIVATE_S3_REGION_NAME='eu-west-1',
+    )
+    def test_redirect_s3(self):
+        storage = PrivateS3BotoStorage()
+        private_file = PrivateFile(RequestFactory().get('/'), storage, 'dossier/file1.pdf')
+        private_file.content_disposition = b"attachment; filename*=UTF-8''file1.pdf"
+
+        response = get_server_class('redirect').serve(private_file)
+        self.assertEqual(response.status_code, 302)
+        url = urlsplit(response['Location'])
+        self.assertEqual(url.path, '/dossier/file1.pdf')
+        query = parse_qs(url.query)
+        self.assertEqual(query['response-content-type'], ['application/pdf'])
+        self.assertEqual(query['response-content-disposition'], ["attachment; filename*=UTF-8''file1.pdf"])
+
+    def test_filesystem_fallback(self):
+        """
+        Storages without presigned URLs send the file instead.
+        """
+        storage = PrivateFileSystemStorage()
+        storage.save('redirect/test.txt', ContentFile(b'0123456789'))
+        try:
+            private_file = PrivateFile(RequestFactory().get('/'), storage, 'redirect/test.txt')
+            response = get_server_class('redirect').serve(private_file)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+            response.close()
+        finally:
+            storage.delete('redirect/test.txt')
+
+
+class RemoteStorage(PrivateFileSystemStorage):
+    """
+    Stand-in for object storage, which has no local paths.
+    """
+
+    def path(self, name):
+        raise NotImplementedError()
+
+    def get_etag(self, name):
+        return '"remote"'
+
+    def presigned_url(self, name, expire=None, content_type=None, content_disposition=None):
+        return f'https://bucket.example.com/{name}?expire={expire}'
+
+
+class NginxXAccelRedirectServerTests(SimpleTestCase):
+
+    def test_local_file(self):
+        private_file = PrivateFile(RequestFactory().get('/'), PrivateFileSystemStorage(), 'dossier/file 1.pdf')
+        private_file.etag = '"local"'
+
+        response = NginxXAccelRedirectServer.serve(private_file)
+        self.assertEqual(response['X-Accel-Redirect'], '/private-x-accel-redirect/dossier/file%201.pdf')
+        self.assertNotIn('X-Private-Storage-Url', response)
+        self.assertNotIn('X-Accel-Buffering', response)
+
+    def test_proxy_remote_file(self):
+        class LimitedServer(NginxXAccelRedirectServer):
+            accel_buffering = False
+            accel_limit_rate = 1024
+            accel_expires = 0
+
+        private_file = PrivateFile(RequestFactory().get('/'), RemoteStorage(), 'dossier/file1.pdf')
+        response = LimitedServer.serve(private_file)
+        self.assertEqual(response['X-Accel-Redirect'], '/private-x-accel-proxy/dossier/file1.pdf')
+        self.assertEqual(response['X-Private-Storage-Url'], 'https://bucket.example.com/dossier/file1.pdf?expire=60')
+        self.assertEqual(response['X-Accel-Buffering'], 'no')
+        self.assertEqual(response['X-Accel-Limit-Rate'], '1024')
+        self.assertEqual(response['X-Accel-Expires'], '0')
+        self.assertEqual(response['ETag'], '"remote"')
+
+
+class StreamingServerMmapTests(PrivateFileTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.storage = PrivateFileSystemStorage()
+        self.storage.save('mmap/test.txt', ContentFile(b'0123456789'))
+
+    def test_file_wrapper(self):
+        """
+        With wsgi.file_wrapper, the WSGI server receives the file.
+        """
+        request = RequestFactory().get('/', **{'wsgi.file_wrapper': object})
+        response = DjangoStreamingServer.serve(PrivateFile(request, self.storage, 'mmap/test.txt'))
+        self.assertIsInstance(response, FileResponse)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        self.assertEqual(response['Content-Length'], '10')
+        response.close()
+
+    def test_mmap(self):
+        """
+        Without wsgi.file_wrapper, local files are memory mapped.
+        """
+        request = RequestFactory().get('/')
+        with mock.patch('private_storage.servers.iter_mmap_range', wraps=iter_mmap_range) as mmap_range:
+            response = DjangoStreamingServer.serve(PrivateFile(request, self.storage, 'mmap/test.txt'))
+            self.assertNotIsInstance(response, FileResponse)
+            self.assertIsInstance(response, StreamingHttpResponse)
+            self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+
+            request = RequestFactory().get('/', HTTP_RANGE='bytes=2-5')
+            response = DjangoStreamingServer.serve(PrivateFile(request, self.storage, 'mmap/test.txt'))
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(b''.join(response.streaming_content), b'2345')
+        self.assertEqual(mmap_range.call_count, 2)
+
+
+class MemoryCacheTests(PrivateFileTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.storage = PrivateFileSystemStorage()
+        self.storage.save('memory/small.txt', ContentFile(b'0123456789'))
+        self.storage.save('memory/large.txt', ContentFile(b'x' * 200))
+        memory_cache.clear()
+
+    @mock.patch.object(memory_cache, 'max_size', 1000)
+    @mock.patch.object(memory_cache, 'max_file_size', 100)
+    def test_memory_cache(self):
+        def serve(name, **headers):
+            private_file = PrivateFile(RequestFactory().get('/', **headers), self.storage, name)
+            with mock.patch.object(self.storage, 'open', wraps=self.storage.open) as open:
+                response = DjangoStreamingServer.serve(private_file)
+            return response, open.call_count
+
+        response, opened = serve('memory/small.txt')
+        self.assertEqual(response.content, b'0123456789')
+        self.assertEqual(opened, 1)
+
+        response, opened = serve('memory/small.txt')
+        self.assertEqual(response.content, b'0123456789')
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(opened, 0)
+
+        response, opened = serve('memory/small.txt', HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, b'2345')
+        self.assertEqual(opened, 0)
+
+        # Large files are streamed as usual.
+        response, opened = serve('memory/large.txt')
+        self.assertTrue(response.streaming)
+        response.close()
+
+        self.assertEqual(memory_cache.get_stats(), {'hits': 2, 'misses': 1, 'files': 1, 'size': 10})
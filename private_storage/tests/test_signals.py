@@ -0,0 +1,65 @@
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory
+
+from private_storage import signals
+from private_storage.servers import DjangoStreamingServer, NginxXAccelRedirectServer
+from private_storage.tests.models import CustomerDossier
+from private_storage.tests.utils import PrivateFileTestCase
+from private_storage.views import PrivateStorageView
+
+
+class SignalTests(PrivateFileTestCase):
+
+    def setUp(self):
+        super().setUp()
+        CustomerDossier.objects.create(
+            customer='cust1',
+            file=SimpleUploadedFile('test1.txt', b'0123456789')
+        )
+        self.superuser = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.served = []
+        self.sent = []
+
+        def on_file_served(**kwargs):
+            self.served.append(kwargs)
+
+        def on_file_sent(**kwargs):
+            self.sent.append(kwargs)
+
+        signals.file_served.connect(on_file_served, weak=False, dispatch_uid='test_file_served')
+        signals.file_sent.connect(on_file_sent, weak=False, dispatch_uid='test_file_sent')
+        self.addCleanup(signals.file_served.disconnect, dispatch_uid='test_file_served')
+        self.addCleanup(signals.file_sent.disconnect, dispatch_uid='test_file_sent')
+
+    def get(self, view):
+        request = RequestFactory().get('/cust1/file/')
+        request.user = self.superuser
+        return view(request, path='CustomerDossier/cust1/test1.txt')
+
+    def test_signals(self):
+        """
+        The timings and bytes sent are reported when the body is completely sent.
+        """
+        response = self.get(PrivateStorageView.as_view(server_class=DjangoStreamingServer))
+        self.assertEqual(len(self.served), 1)
+        self.assertEqual(self.served[0]['server_class'], DjangoStreamingServer)
+        self.assertEqual(list(self.served[0]['timings']), ['auth', 'metadata', 'open', 'serve'])
+        self.assertEqual(self.sent, [])
+
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual(self.sent[0]['bytes_sent'], 10)
+        self.assertIs(self.sent[0]['response'], response)
+        self.assertEqual(
+            set(self.sent[0]['timings']), {'auth', 'metadata', 'serve', 'open', 'first_byte', 'total'}
+        )
+
+    def test_server_timing(self):
+        """
+        The Server-Timing header contains the timings until the response was generated.
+        """
+        response = self.get(PrivateStorageView.as_view(server_class=NginxXAccelRedirectServer, server_timing=True))
+        self.assertRegex(response['Server-Timing'], r'^auth;dur=[\d.]+, metadata;dur=[\d.]+, serve;dur=[\d.]+$')
+        self.assertEqual(self.sent[0]['bytes_sent'], 0)
+        self.assertNotIn('first_byte', self.sent[0]['timings'])
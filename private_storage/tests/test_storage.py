@@ -0,0 +1,329 @@
+import datetime
+import io
+import os
+import threading
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import urllib3
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.core.files.storage import Storage
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from private_storage.models import PrivateFile
+from private_storage.servers import DjangoServer, NginxXAccelRedirectServer
+from private_storage.signals import connection_pool_wait
+from private_storage.storage.files import PrivateFileSystemStorage
+from private_storage.storage.localcache import PrivateLocalCacheStorage
+from private_storage.storage.s3boto3 import PrivateS3BotoStorage
+from private_storage.storage.utils import get_instrumented_pool_classes
+from private_storage.tests.utils import PrivateFileTestCase
+
+try:
+    from minio.error import S3Error
+
+    from private_storage.storage.minio import PrivateMinioStorage
+except ImportError:
+    PrivateMinioStorage = None
+
+S3_SETTINGS = {
+    'AWS_PRIVATE_ACCESS_KEY_ID': 'AKIAEXAMPLE',
+    'AWS_PRIVATE_SECRET_ACCESS_KEY': 'secret',
+    'AWS_PRIVATE_S3_REGION_NAME': 'eu-west-1',
+    'AWS_PRIVATE_STORAGE_BUCKET_NAME': 'private-files',
+}
+
+
+@override_settings(**S3_SETTINGS)
+class S3MultipartUploadTests(SimpleTestCase):
+
+    @override_settings(
+        AWS_PRIVATE_MULTIPART_THRESHOLD=64 * 1024 * 1024,
+        AWS_PRIVATE_MULTIPART_CHUNKSIZE=16 * 1024 * 1024,
+        AWS_PRIVATE_MULTIPART_CONCURRENCY=32,
+    )
+    def test_transfer_config(self):
+        storage = PrivateS3BotoStorage()
+        self.assertEqual(storage.transfer_config.multipart_threshold, 64 * 1024 * 1024)
+        self.assertEqual(storage.transfer_config.multipart_chunksize, 16 * 1024 * 1024)
+        self.assertEqual(storage.transfer_config.max_concurrency, 32)
+        self.assertEqual(storage.client_config.max_pool_connections, 32)
+
+        with mock.patch.object(PrivateS3BotoStorage, 'bucket') as bucket, \
+                mock.patch.object(storage, 'exists', return_value=False):
+            storage.save('dossier/large.bin', ContentFile(b'data'))
+
+        upload_fileobj = bucket.Object.return_value.upload_fileobj
+        self.assertIs(upload_fileobj.call_args.kwargs['Config'], storage.transfer_config)
+
+    def test_default_transfer_config(self):
+        storage = PrivateS3BotoStorage()
+        self.assertEqual(storage.transfer_config.multipart_threshold, 8 * 1024 * 1024)
+        self.assertEqual(storage.transfer_config.max_concurrency, 10)
+
+
+@override_settings(**S3_SETTINGS)
+class S3ConnectionPoolTests(SimpleTestCase):
+
+    @override_settings(
+        AWS_PRIVATE_S3_MAX_POOL_CONNECTIONS=50,
+        AWS_PRIVATE_S3_CONNECT_TIMEOUT=2,
+        AWS_PRIVATE_S3_READ_TIMEOUT=10,
+        AWS_PRIVATE_S3_TCP_KEEPALIVE=True,
+        AWS_PRIVATE_S3_RETRIES={'max_attempts': 5, 'mode': 'adaptive'},
+    )
+    def test_client_config(self):
+        storage = PrivateS3BotoStorage()
+        config = storage.connection.meta.client.meta.config
+        self.assertEqual(config.max_pool_connections, 50)
+        self.assertEqual(config.connect_timeout, 2)
+        self.assertEqual(config.read_timeout, 10)
+        self.assertTrue(config.tcp_keepalive)
+        self.assertEqual(config.retries['mode'], 'adaptive')
+
+    def test_shared_client(self):
+        storage1 = PrivateS3BotoStorage()
+        storage2 = PrivateS3BotoStorage()
+        connection = storage1.connection
+        self.assertIs(storage2.connection.meta.client, connection.meta.client)
+
+        # Each thread has its own resource, but shares the client.
+        connections = []
+        thread = threading.Thread(target=lambda: connections.append(storage1.connection))
+        thread.start()
+        thread.join()
+        self.assertIsNot(connections[0], connection)
+        self.assertIs(connections[0].meta.client, connection.meta.client)
+
+    def test_connection_pool_wait(self):
+        calls = []
+
+        def receiver(sender, **kwargs):
+            calls.append(kwargs)
+
+        pool_class = get_instrumented_pool_classes({'http': urllib3.HTTPConnectionPool})['http']
+        pool = pool_class('localhost', maxsize=1)
+        connection_pool_wait.connect(receiver)
+        try:
+            conn = pool._get_conn()
+            pool._put_conn(conn)
+            pool._get_conn()
+        finally:
+            connection_pool_wait.disconnect(receiver)
+
+        self.assertEqual([(call['host'], call['new_connection']) for call in calls], [
+            ('localhost', True),
+            ('localhost', False),
+        ])
+        self.assertGreaterEqual(calls[0]['wait'], 0)
+
+
+class MinioStandIn:
+    """
+    A minimal in-memory stand-in for ``minio.Minio``.
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def put_object(self, bucket_name, object_name, data, length, content_type, **kwargs):
+        self.calls.append(('put_object', kwargs))
+        self.objects[object_name] = data.read()
+
+    def stat_object(self, bucket_name, object_name):
+        self._check_exists(object_name)
+        return SimpleNamespace(
+            size=len(self.objects[object_name]),
+            etag='etag',
+            content_type='application/octet-stream',
+            last_modified=datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc),
+        )
+
+    def get_object(self, bucket_name, object_name, offset=0, length=0, request_headers=None):
+        with self.lock:
+            self.calls.append(('get_object', offset, length, request_headers))
+        self._check_exists(object_name)
+        response = io.BytesIO(self.objects[object_name][offset:offset + length])
+        response.release_conn = lambda: None
+        return response
+
+    def _check_exists(self, object_name):
+        if object_name not in self.objects:
+            raise S3Error(
+                code='NoSuchKey', message='Object does not exist', resource=object_name,
+                request_id='', host_id='', response=None,
+            )
+
+
+@unittest.skipIf(PrivateMinioStorage is None, "minio is not installed")
+@override_settings(
+    MINIO_PRIVATE_STORAGE_ENDPOINT='localhost:9000',
+    MINIO_PRIVATE_STORAGE_ACCESS_KEY='access',
+    MINIO_PRIVATE_STORAGE_SECRET_KEY='secret',
+    MINIO_PRIVATE_STORAGE_MEDIA_BUCKET_NAME='private-files',
+    MINIO_PRIVATE_STORAGE_ASSUME_MEDIA_BUCKET_EXISTS=True,
+    MINIO_PRIVATE_STORAGE_PART_SIZE=4,
+    MINIO_PRIVATE_STORAGE_PARALLEL_UPLOADS=5,
+)
+class MinioPartsTests(SimpleTestCase):
+
+    def test_parallel_upload(self):
+        client = MinioStandIn()
+        storage = PrivateMinioStorage(minio_client=client)
+        storage._save('dossier/file.bin', ContentFile(b'0123456789'))
+        self.assertEqual(client.calls, [('put_object', {
+            'metadata': None, 'part_size': 4, 'num_parallel_uploads': 5,
+        })])
+
+    def test_parallel_download(self):
+        client = MinioStandIn()
+        client.objects['dossier/file.bin'] = b'0123456789'
+        storage = PrivateMinioStorage(minio_client=client)
+
+        file = io.BytesIO()
+        self.assertEqual(storage.download('dossier/file.bin', file), 10)
+        self.assertEqual(file.read(), b'0123456789')
+        self.assertEqual(sorted(call[1:3] for call in client.calls), [(0, 4), (4, 4), (8, 2)])
+        self.assertEqual(client.calls[0][3], {'If-Match': '"etag"'})
+
+    @override_settings(USE_TZ=False)
+    def test_stat(self):
+        client = MinioStandIn()
+        client.objects['dossier/file.bin'] = b'0123456789'
+        storage = PrivateMinioStorage(minio_client=client)
+
+        stat = storage.stat('dossier/file.bin')
+        self.assertEqual(stat['size'], 10)
+        self.assertIsNone(stat['modified_time'].tzinfo)
+        self.assertIsNone(storage.stat('dossier/missing.bin'))
+
+    def test_open_range_missing(self):
+        storage = PrivateMinioStorage(minio_client=MinioStandIn())
+        with self.assertRaises(FileNotFoundError):
+            storage.open_range('dossier/missing.bin', 0, 9)
+
+
+class RemoteStorage(Storage):
+    """
+    Stand-in for object storage, which has no local paths.
+    The ETag is the file contents.
+    """
+
+    def __init__(self):
+        self.files = PrivateFileSystemStorage(location=os.path.join(settings.PRIVATE_STORAGE_ROOT, 'remote'))
+        self.opened = []
+
+    def _open(self, name, mode='rb'):
+        self.opened.append(name)
+        return self.files.open(name, mode)
+
+    def _save(self, name, content):
+        return self.files.save(name, content)
+
+    def delete(self, name):
+        self.files.delete(name)
+
+    def exists(self, name):
+        return self.files.exists(name)
+
+    def get_etag(self, name):
+        return self.stat(name)['etag']
+
+    def size(self, name):
+        return self.files.size(name)
+
+    def get_modified_time(self, name):
+        return self.files.get_modified_time(name)
+
+    def stat(self, name):
+        with self.files.open(name) as file:
+            return {'size': file.size, 'etag': '"{}"'.format(file.read().decode())}
+
+
+class LocalCacheStorageTests(PrivateFileTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.remote = RemoteStorage()
+        self.storage = PrivateLocalCacheStorage(
+            self.remote, location=os.path.join(settings.PRIVATE_STORAGE_ROOT, 'cache'), max_size=10
+        )
+
+    def test_read_through(self):
+        self.storage.save('dossier/file1.txt', ContentFile(b'1234'))
+        path = self.storage.path('dossier/file1.txt')
+        self.assertEqual(path, os.path.join(self.storage.location, 'files', 'dossier', 'file1.txt'))
+        self.assertEqual(self.storage.path('dossier/file1.txt'), path)
+        with self.storage.open('dossier/file1.txt') as file:
+            self.assertEqual(file.read(), b'1234')
+        self.assertEqual(self.remote.opened, ['dossier/file1.txt'])
+
+        # A changed ETag downloads the file again.
+        self.remote.delete('dossier/file1.txt')
+        self.remote.save('dossier/file1.txt', ContentFile(b'5678'))
+        with open(self.storage.path('dossier/file1.txt'), 'rb') as file:
+            self.assertEqual(file.read(), b'5678')
+        self.assertEqual(len(self.remote.opened), 2)
+
+        # The servers send the local copy.
+        private_file = PrivateFile(RequestFactory().get('/'), self.storage, 'dossier/file1.txt')
+        response = NginxXAccelRedirectServer.serve(private_file)
+        self.assertEqual(response['X-Accel-Redirect'], '/private-x-accel-redirect/dossier/file1.txt')
+
+    def test_evict_least_recently_used(self):
+        for name in ('a.txt', 'b.txt', 'c.txt'):
+            self.storage.save(name, ContentFile(b'1234'))
+
+        self.storage.path('a.txt')
+        with mock.patch('private_storage.storage.localcache.os.walk', wraps=os.walk) as walk:
+            # The cache size is tracked, so the cache is only walked to remove files.
+            self.storage.path('b.txt')
+            walk.assert_not_called()
+        os.utime(os.path.join(self.storage.location, 'etags', 'a.txt'), (0, 0))
+        self.storage.path('c.txt')
+
+        self.assertFalse(self.storage.is_cached('a.txt'))
+        self.assertTrue(self.storage.is_cached('b.txt'))
+        self.assertTrue(self.storage.is_cached('c.txt'))
+
+    def test_larger_than_cache(self):
+        """
+        Files larger than the cache are read from the remote storage.
+        """
+        self.storage.save('large.txt', ContentFile(b'0123456789abcdef'))
+        with self.assertRaises(NotImplementedError):
+            self.storage.path('large.txt')
+        self.assertFalse(self.storage.is_cached('large.txt'))
+
+        with self.storage.open('large.txt') as file:
+            self.assertEqual(file.read(), b'0123456789abcdef')
+        with self.storage.open_range('large.txt', 10, 15) as file:
+            self.assertEqual(file.read(6), b'abcdef')
+
+        # The servers stream the file from the remote storage.
+        private_file = PrivateFile(RequestFactory().get('/'), self.storage, 'large.txt')
+        response = DjangoServer.serve(private_file)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789abcdef')
+
+    def test_single_metadata_lookup(self):
+        """
+        The metadata that the PrivateFile fetched is reused to validate the local copy.
+        """
+        self.storage.save('dossier/file2.txt', ContentFile(b'1234'))
+        with mock.patch.object(self.remote, 'stat', wraps=self.remote.stat) as stat:
+            private_file = PrivateFile(RequestFactory().get('/'), self.storage, 'dossier/file2.txt')
+            self.assertTrue(private_file.exists())
+            response = NginxXAccelRedirectServer.serve(private_file)
+        self.assertEqual(response['X-Accel-Redirect'], '/private-x-accel-redirect/dossier/file2.txt')
+        self.assertEqual(stat.call_count, 1)
+
+    def test_settings_required(self):
+        with self.assertRaises(ImproperlyConfigured):
+            PrivateLocalCacheStorage(self.remote)
+        with self.assertRaises(ImproperlyConfigured):
+            PrivateLocalCacheStorage(location=self.storage.location)
@@ -0,0 +1,67 @@
+import os
+import tempfile
+from unittest import skipIf
+
+from django.test import SimpleTestCase
+
+from private_storage.streaming import ReadAheadIterator, aiter_mmap_range, iter_mmap_range
+
+try:
+    from asgiref.sync import async_to_sync
+except ImportError:  # Django < 3.0
+    async_to_sync = None
+
+
+class ReadAheadIteratorTests(SimpleTestCase):
+
+    def test_read_ahead(self):
+        chunks = [b'chunk%d' % i for i in range(10)]
+        self.assertEqual(list(ReadAheadIterator(iter(chunks), 2)), chunks)
+
+    def test_read_error(self):
+        def failing():
+            yield b'chunk1'
+            raise OSError("connection lost")
+
+        iterator = ReadAheadIterator(failing(), 2)
+        self.assertEqual(next(iterator), b'chunk1')
+        with self.assertRaises(OSError):
+            next(iterator)
+
+    def test_close(self):
+        closed = []
+
+        def endless():
+            try:
+                while True:
+                    yield b'chunk'
+            finally:
+                closed.append(True)
+
+        iterator = ReadAheadIterator(endless(), 2)
+        self.assertEqual(next(iterator), b'chunk')
+        iterator.close()
+        iterator._thread.join(timeout=5)
+        self.assertEqual(closed, [True])
+        self.assertEqual(list(iterator), [])
+
+
+class MmapRangeTests(SimpleTestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.write(fd, b'0123456789')
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+
+    def test_iter_mmap_range(self):
+        self.assertEqual(list(iter_mmap_range(self.path, 0, 9, chunk_size=4)), [b'0123', b'4567', b'89'])
+        self.assertEqual(list(iter_mmap_range(self.path, 3, 6, chunk_size=4)), [b'3456'])
+        self.assertEqual(list(iter_mmap_range(self.path, 0, -1)), [])
+
+    @skipIf(async_to_sync is None, "asgiref is not installed")
+    def test_aiter_mmap_range(self):
+        async def read():
+            return [chunk async for chunk in aiter_mmap_range(self.path, 2, 9, chunk_size=3)]
+
+        self.assertEqual(async_to_sync(read)(), [b'234', b'567', b'89'])
@@ -0,0 +1,58 @@
+from django.contrib.auth import SESSION_KEY
+from django.contrib.auth.models import User
+from django.core.exceptions import PermissionDenied
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from private_storage.tests.models import CustomerDossier
+from private_storage.tests.utils import PrivateFileTestCase
+from private_storage.tokens import check_token, get_token_url, make_token
+from private_storage.views import PrivateStorageTokenView
+
+
+class TokenTests(SimpleTestCase):
+
+    def test_check_token(self):
+        token = make_token('dossier/file1.pdf')
+        self.assertTrue(check_token(token, 'dossier/file1.pdf'))
+        self.assertFalse(check_token(token, 'dossier/file2.pdf'))
+        self.assertFalse(check_token(token + 'x', 'dossier/file1.pdf'))
+
+    def test_expired_token(self):
+        token = make_token('dossier/file1.pdf', expire=-1)
+        self.assertFalse(check_token(token, 'dossier/file1.pdf'))
+
+    def test_user_token(self):
+        user = User(pk=5)
+        token = make_token('dossier/file1.pdf', user=user)
+        request = RequestFactory().get('/')
+        self.assertFalse(check_token(token, 'dossier/file1.pdf', request))
+
+        request.session = {SESSION_KEY: '6'}
+        self.assertFalse(check_token(token, 'dossier/file1.pdf', request))
+
+        request.session = {SESSION_KEY: '5'}
+        self.assertTrue(check_token(token, 'dossier/file1.pdf', request))
+
+
+@override_settings(ROOT_URLCONF='private_storage.tests.urls')
+class TokenViewTests(PrivateFileTestCase):
+
+    def test_token_view(self):
+        """
+        The token view doesn't need a user or session.
+        """
+        CustomerDossier.objects.create(customer='cust1', file=SimpleUploadedFile('token.txt', b'token'))
+        name = 'CustomerDossier/cust1/token.txt'
+        url = get_token_url(name)
+        self.assertTrue(url.startswith('/private-token/'))
+        self.assertTrue(url.endswith('/' + name))
+
+        token = url.split('/')[2]
+        view = PrivateStorageTokenView.as_view()
+        request = RequestFactory().get(url)
+        response = view(request, token=token, path=name)
+        self.assertEqual(b''.join(response.streaming_content), b'token')
+
+        with self.assertRaises(PermissionDenied):
+            view(request, token=token, path='CustomerDossier/cust1/other.txt')
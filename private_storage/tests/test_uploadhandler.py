@@ -0,0 +1,56 @@
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import MemoryFileUploadHandler
+from django.test import RequestFactory, SimpleTestCase
+
+from private_storage.tests.models import RestrictedDossier
+from private_storage.uploadhandler import PrivateFileUploadHandler, RejectedUploadedFile, is_content_type_allowed
+
+PDF = b'%PDF-1.4\n' + b'x' * 100
+
+
+class UploadHandlerTests(SimpleTestCase):
+
+    def upload(self, name, content, content_type):
+        request = RequestFactory().post('/', {'file': SimpleUploadedFile(name, content, content_type)})
+        request.upload_handlers = [
+            PrivateFileUploadHandler.for_model(request, RestrictedDossier),
+            MemoryFileUploadHandler(request),
+        ]
+        return request.FILES['file']
+
+    def clean(self, file):
+        # Like ModelForm does, by assigning the file to the model.
+        obj = RestrictedDossier(file=file)
+        return RestrictedDossier._meta.get_field('file').clean(obj.file, obj)
+
+    def test_is_content_type_allowed(self):
+        self.assertTrue(is_content_type_allowed(PDF, 'application/pdf', ['application/pdf']))
+        self.assertFalse(is_content_type_allowed(b'MZ\x90\x00', 'application/pdf', ['application/pdf']))
+        self.assertFalse(is_content_type_allowed(b'plain text', 'application/pdf', ['application/pdf']))
+        self.assertTrue(is_content_type_allowed(b'plain text', 'text/plain', ['text/plain']))
+        self.assertTrue(is_content_type_allowed(
+            b'PK\x03\x04', 'application/octet-stream',
+            ['application/vnd.openxmlformats-officedocument.wordprocessingml.document']
+        ))
+
+    def test_valid_file(self):
+        file = self.upload('test.pdf', PDF, 'application/pdf')
+        self.assertNotIsInstance(file, RejectedUploadedFile)
+        self.assertEqual(file.read(), PDF)
+        self.clean(file)
+
+    def test_magic_bytes(self):
+        file = self.upload('test.pdf', b'MZ\x90\x00' + b'x' * 100, 'application/pdf')
+        self.assertIsInstance(file, RejectedUploadedFile)
+        self.assertEqual(file.rejected_reason, 'invalid_file_type')
+        with self.assertRaisesMessage(ValidationError, 'File type not supported.'):
+            self.clean(file)
+
+    def test_too_large(self):
+        file = self.upload('test.pdf', PDF + b'x' * 1000, 'application/pdf')
+        self.assertIsInstance(file, RejectedUploadedFile)
+        self.assertEqual(file.rejected_reason, 'file_too_large')
+        self.assertEqual(file.read(), b'')
+        with self.assertRaisesMessage(ValidationError, 'The file may not be larger than'):
+            self.clean(file)
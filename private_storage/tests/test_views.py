@@ -1,11 +1,26 @@
+import io
+import zipfile
+from unittest import mock, skipUnless
+
+import django
 from django.contrib.auth.models import User
+from django.core.exceptions import PermissionDenied
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.http import FileResponse
 from django.test import RequestFactory
 
-from private_storage.tests.models import CustomerDossier
+from private_storage import appconfig
+from private_storage.servers import ApacheXSendfileServer, DjangoServer, DjangoStreamingServer, \
+    NginxXAccelRedirectServer
+from private_storage.tests.models import AttachmentsDossier, CustomerDossier
 from private_storage.tests.utils import PrivateFileTestCase
-from private_storage.views import PrivateStorageDetailView, PrivateStorageView
+from private_storage.views import AsyncPrivateStorageView, PrivateStorageDetailView, PrivateStorageView, \
+    PrivateStorageZipView
+
+try:
+    from asgiref.sync import async_to_sync
+except ImportError:  # Django < 3.0
+    async_to_sync = None
 
 
 class ViewTests(PrivateFileTestCase):
@@ -126,3 +141,167 @@ class ViewTests(PrivateFileTestCase):
                 self.assertEqual(response['Content-Length'], '5')
                 self.assertEqual(response['Content-Disposition'], expect_header, user_agent)
                 self.assertIn('Last-Modified', response)
+
+    def test_range_request(self):
+        """
+        Test partial content responses for the Range header.
+        """
+        CustomerDossier.objects.create(
+            customer='cust3',
+            file=SimpleUploadedFile('test8.txt', b'0123456789')
+        )
+        superuser = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+
+        for server_class in (DjangoServer, DjangoStreamingServer):
+            view = PrivateStorageView.as_view(server_class=server_class)
+
+            request = RequestFactory().get('/cust3/file/', HTTP_RANGE='bytes=2-5')
+            request.user = superuser
+            response = view(request, path='CustomerDossier/cust3/test8.txt')
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(b''.join(response.streaming_content), b'2345')
+            self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+            self.assertEqual(response['Content-Length'], '4')
+
+            request = RequestFactory().get('/cust3/file/', HTTP_RANGE='bytes=0-1,-2')
+            request.user = superuser
+            response = view(request, path='CustomerDossier/cust3/test8.txt')
+            self.assertEqual(response.status_code, 206)
+            self.assertTrue(response['Content-Type'].startswith('multipart/byteranges; boundary='))
+            content = b''.join(response.streaming_content)
+            self.assertEqual(len(content), int(response['Content-Length']))
+            self.assertIn(b'Content-Range: bytes 0-1/10\r\n\r\n01\r\n', content)
+            self.assertIn(b'Content-Range: bytes 8-9/10\r\n\r\n89\r\n', content)
+
+            request = RequestFactory().get('/cust3/file/', HTTP_RANGE='bytes=20-')
+            request.user = superuser
+            response = view(request, path='CustomerDossier/cust3/test8.txt')
+            self.assertEqual(response.status_code, 416)
+            self.assertEqual(response['Content-Range'], 'bytes */10')
+
+            # A stale If-Range gives the whole file
+            request = RequestFactory().get(
+                '/cust3/file/', HTTP_RANGE='bytes=2-5', HTTP_IF_RANGE='Thu, 01 Jan 1970 00:00:00 GMT'
+            )
+            request.user = superuser
+            response = view(request, path='CustomerDossier/cust3/test8.txt')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+
+    def test_etag(self):
+        """
+        Test If-None-Match support for all servers.
+        """
+        CustomerDossier.objects.create(
+            customer='cust4',
+            file=SimpleUploadedFile('test9.txt', b'test9')
+        )
+        superuser = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        servers = (DjangoServer, DjangoStreamingServer, ApacheXSendfileServer, NginxXAccelRedirectServer)
+
+        for server_class in servers:
+            view = PrivateStorageView.as_view(server_class=server_class)
+            request = RequestFactory().get('/cust4/file/')
+            request.user = superuser
+            response = view(request, path='CustomerDossier/cust4/test9.txt')
+            self.assertEqual(response.status_code, 200)
+            etag = response['ETag']
+            self.assertTrue(etag.startswith('"'))
+
+            for if_none_match in (etag, f'W/{etag}', f'"other", {etag}', '*'):
+                request = RequestFactory().get('/cust4/file/', HTTP_IF_NONE_MATCH=if_none_match)
+                request.user = superuser
+                response = view(request, path='CustomerDossier/cust4/test9.txt')
+                self.assertEqual(response.status_code, 304, server_class)
+                self.assertEqual(response['ETag'], etag)
+
+            request = RequestFactory().get('/cust4/file/', HTTP_IF_NONE_MATCH='"other"')
+            request.user = superuser
+            response = view(request, path='CustomerDossier/cust4/test9.txt')
+            self.assertEqual(response.status_code, 200)
+
+    @skipUnless(django.VERSION >= (4, 2), "Async streaming responses require Django 4.2")
+    def test_async_view(self):
+        """
+        Test the async view, which streams the file with an async iterator.
+        """
+        CustomerDossier.objects.create(
+            customer='cust5',
+            file=SimpleUploadedFile('test10.txt', b'0123456789')
+        )
+        superuser = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        view = async_to_sync(AsyncPrivateStorageView.as_view())
+
+        async def read(response):
+            return b''.join([chunk async for chunk in response.streaming_content])
+
+        for range_header, expect_status, expect_content in [
+                (None, 200, b'0123456789'),
+                ('bytes=2-5', 206, b'2345'),
+                ]:
+            request = RequestFactory().get('/cust5/file/', HTTP_RANGE=range_header) \
+                if range_header else RequestFactory().get('/cust5/file/')
+            request.user = superuser
+            response = view(request, path='CustomerDossier/cust5/test10.txt')
+            self.assertEqual(response.status_code, expect_status)
+            self.assertTrue(response.is_async)
+            self.assertEqual(async_to_sync(read)(response), expect_content)
+            self.assertEqual(response['Content-Type'], 'text/plain')
+            self.assertIn('ETag', response)
+
+        request = RequestFactory().head('/cust5/file/')
+        request.user = superuser
+        response = view(request, path='CustomerDossier/cust5/test10.txt')
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['Content-Length'], '10')
+
+    @mock.patch.object(appconfig, 'PRIVATE_STORAGE_STREAMING_CHUNK_SIZE', 4)
+    @mock.patch.object(appconfig, 'PRIVATE_STORAGE_STREAMING_READ_AHEAD', 2)
+    def test_streaming_read_ahead(self):
+        """
+        Test the streaming server, reading chunks in a background thread.
+        """
+        CustomerDossier.objects.create(
+            customer='cust6',
+            file=SimpleUploadedFile('test11.txt', b'0123456789')
+        )
+        superuser = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        view = PrivateStorageView.as_view(server_class=DjangoStreamingServer)
+
+        request = RequestFactory().get('/cust6/file/')
+        request.user = superuser
+        response = view(request, path='CustomerDossier/cust6/test11.txt')
+        self.assertEqual(list(response.streaming_content), [b'0123', b'4567', b'89'])
+        self.assertEqual(response['Content-Length'], '10')
+
+    def test_zip_view(self):
+        """
+        Test downloading multiple files as ZIP.
+        """
+        obj = AttachmentsDossier.objects.create(
+            customer='cust7',
+            file1=SimpleUploadedFile('report.txt', b'report' * 1000),
+            file2=SimpleUploadedFile('photo.png', b'\x89PNG fake image'),
+            file3=SimpleUploadedFile('report.txt', b'other report'),
+        )
+        superuser = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        view = PrivateStorageZipView.as_view(model=AttachmentsDossier, model_file_fields=('file1', 'file2', 'file3'))
+
+        request = RequestFactory().get('/cust7/zip/')
+        request.user = superuser
+        request.META['HTTP_USER_AGENT'] = 'Test'
+        response = view(request, pk=obj.pk)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        self.assertEqual(response['Content-Disposition'], "attachment; filename*=UTF-8''cust7.zip")
+
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(archive.namelist(), ['report.txt', 'photo.png', 'report (2).txt'])
+        self.assertEqual(archive.read('report.txt'), b'report' * 1000)
+        self.assertEqual(archive.read('report (2).txt'), b'other report')
+        self.assertEqual(archive.getinfo('report.txt').compress_type, zipfile.ZIP_DEFLATED)
+        self.assertEqual(archive.getinfo('photo.png').compress_type, zipfile.ZIP_STORED)
+
+        request = RequestFactory().get('/cust7/zip/')
+        request.user = User.objects.create_user('user', 'user@example.com', 'user')
+        with self.assertRaises(PermissionDenied):
+            view(request, pk=obj.pk)
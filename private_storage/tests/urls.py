@@ -0,0 +1,8 @@
+from django.urls import path, re_path
+
+from private_storage.views import PrivateStorageTokenView, PrivateStorageView
+
+urlpatterns = [
+    path('private-token/<str:token>/<path:path>', PrivateStorageTokenView.as_view(), name='serve_private_file_token'),
+    re_path(r'^private-media/(?P<path>.*)$', PrivateStorageView.as_view(), name='serve_private_file'),
+]
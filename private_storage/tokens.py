@@ -0,0 +1,61 @@
+"""
+Signed download tokens, which give temporary access to a file without checking the session.
+
+The token contains the expiry time, and optionally the user ID it's bound to.
+It's signed with the ``SECRET_KEY`` for the file name, so it can't be used for other files.
+"""
+import time
+
+from django.contrib.auth import SESSION_KEY
+from django.core import signing
+from django.urls import reverse
+
+from . import appconfig
+
+SALT = 'private_storage.tokens'
+
+
+def _get_salt(name):
+    return f'{SALT}:{name}'
+
+
+def make_token(name, expire=None, user=None):
+    """
+    Return a signed token to download the file.
+    When a ``user`` is given, the token only works in a session where that user is logged in.
+    """
+    if expire is None:
+        expire = appconfig.PRIVATE_STORAGE_TOKEN_EXPIRE
+
+    payload = [int(time.time()) + expire]
+    if user is not None:
+        payload.append(str(user.pk))
+    return signing.dumps(payload, salt=_get_salt(name))
+
+
+def check_token(token, name, request=None):
+    """
+    Tell whether the token is valid for the file.
+    The session is only read when the token is bound to a user.
+    """
+    try:
+        payload = signing.loads(token, salt=_get_salt(name))
+    except signing.BadSignature:
+        return False
+
+    if payload[0] < time.time():
+        return False
+
+    if len(payload) > 1:
+        session = getattr(request, 'session', None)
+        if session is None or session.get(SESSION_KEY) != payload[1]:
+            return False
+
+    return True
+
+
+def get_token_url(name, expire=None, user=None, url_name='serve_private_file_token'):
+    """
+    Return the URL of the :class:`~private_storage.views.PrivateStorageTokenView` to download the file.
+    """
+    return reverse(url_name, kwargs={'token': make_token(name, expire=expire, user=user), 'path': name})
@@ -0,0 +1,153 @@
+"""
+Upload handler to validate files of a :class:`~private_storage.fields.PrivateFileField` while they are uploaded.
+
+Without it, the ``content_types`` and ``max_file_size`` are only checked after the whole file is received.
+"""
+import io
+
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+
+from .fields import PrivateFileField
+
+#: Magic bytes at the start of common file types, and the content types these files can have.
+#: Content types that end with a ``/`` or ``.`` are matched as prefix.
+SIGNATURES = (
+    (0, b'%PDF-', ('application/pdf',)),
+    (0, b'\x89PNG\r\n\x1a\n', ('image/png',)),
+    (0, b'\xff\xd8\xff', ('image/jpeg', 'image/pjpeg')),
+    (0, b'GIF87a', ('image/gif',)),
+    (0, b'GIF89a', ('image/gif',)),
+    (8, b'WEBP', ('image/webp',)),
+    (0, b'II*\x00', ('image/tiff',)),
+    (0, b'MM\x00*', ('image/tiff',)),
+    (4, b'ftyp', ('video/mp4', 'video/quicktime', 'audio/mp4', 'image/heic', 'image/heif', 'image/avif')),
+    (0, b'\x1f\x8b', ('application/gzip', 'application/x-gzip')),
+    (0, b'PK\x03\x04', (
+        'application/zip', 'application/x-zip-compressed', 'application/epub+zip', 'application/java-archive',
+        'application/vnd.openxmlformats-officedocument.', 'application/vnd.oasis.opendocument.',
+    )),
+    (0, b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', (
+        'application/msword', 'application/vnd.ms-excel', 'application/vnd.ms-powerpoint', 'application/vnd.ms-outlook',
+    )),
+    (0, b'MZ', ('application/x-msdownload', 'application/x-dosexec', 'application/vnd.microsoft.portable-executable')),
+    (0, b'\x7fELF', ('application/x-executable', 'application/x-elf')),
+)
+
+
+def _matches(content_type, patterns):
+    return any(
+        content_type == pattern or (pattern.endswith(('/', '.')) and content_type.startswith(pattern))
+        for pattern in patterns
+    )
+
+
+def get_signature_content_types(data):
+    """
+    Return the content types that match the magic bytes of the data, or ``None`` when the type is not known.
+    """
+    for offset, magic, content_types in SIGNATURES:
+        if data[offset:offset + len(magic)] == magic:
+            return content_types
+    return None
+
+
+def is_content_type_allowed(data, content_type, allowed_content_types):
+    """
+    Tell whether the first bytes of a file are allowed, and match the content type that the client sent.
+    Files without a known signature (e.g. text files) can't be checked, unless the client claimed a type that has one.
+    """
+    detected = get_signature_content_types(data)
+    if detected is not None:
+        return any(_matches(allowed, detected) for allowed in allowed_content_types)
+
+    # The client claimed a type that should have recognizable magic bytes.
+    return not any(_matches(content_type, patterns) for offset, magic, patterns in SIGNATURES)
+
+
+class RejectedUploadedFile(UploadedFile):
+    """
+    Placeholder for a file that was rejected during the upload, so the form can show the error.
+    """
+
+    def __init__(self, name, content_type, size, charset, reason):
+        super().__init__(io.BytesIO(), name, content_type, size, charset)
+        #: The key of :attr:`PrivateFileField.error_messages`.
+        self.rejected_reason = reason
+
+
+class PrivateFileUploadHandler(FileUploadHandler):
+    """
+    Check the ``content_types`` and ``max_file_size`` of a :class:`~private_storage.fields.PrivateFileField`
+    while the file is uploaded. The content type is detected from the magic bytes in the first chunk.
+
+    Rejected files are no longer passed to the next upload handlers, so they are not stored in memory or on disk.
+    The field receives a :class:`RejectedUploadedFile` instead, so the form shows the error.
+    When :attr:`connection_reset` is set, the upload is aborted as soon as a file is too large.
+
+    Install it before the form is parsed::
+
+        request.upload_handlers.insert(0, PrivateFileUploadHandler.for_model(request, MyModel))
+    """
+
+    #: Stop reading the request when a file is too large, instead of discarding the remaining data.
+    #: The form won't show an error for the file then, as the request is not parsed further.
+    connection_reset = False
+
+    def __init__(self, request=None, fields=None):
+        super().__init__(request)
+        #: The fields to check, by form field name.
+        self.fields = fields or {}
+        self.field = None
+        self.rejected_reason = None
+
+    @classmethod
+    def for_model(cls, request, model, prefix=None):
+        """
+        Check all private file fields of a model, for a form that uses the same field names.
+        """
+        return cls(request, fields={
+            f'{prefix}-{field.name}' if prefix else field.name: field
+            for field in model._meta.get_fields()
+            if isinstance(field, PrivateFileField)
+        })
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        self.field = self.fields.get(field_name)
+        self.rejected_reason = None
+
+        if self.field is not None and self.field.max_file_size and content_length \
+                and content_length > self.field.max_file_size:
+            self.reject('file_too_large')
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.field is None:
+            return raw_data
+        elif self.rejected_reason:
+            return None
+
+        if start == 0 and self.field.content_types \
+                and not is_content_type_allowed(raw_data, self.content_type, self.field.content_types):
+            self.reject('invalid_file_type')
+            return None
+
+        if self.field.max_file_size and start + len(raw_data) > self.field.max_file_size:
+            self.reject('file_too_large')
+            return None
+
+        return raw_data
+
+    def reject(self, reason):
+        """
+        Stop receiving the current file.
+        """
+        if reason == 'file_too_large' and self.connection_reset:
+            raise StopUpload(connection_reset=True)
+        self.rejected_reason = reason
+
+    def file_complete(self, file_size):
+        if not self.rejected_reason:
+            # Let the next upload handler return the file.
+            return None
+        return RejectedUploadedFile(self.file_name, self.content_type, file_size, self.charset, self.rejected_reason)
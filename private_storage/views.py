@@ -1,19 +1,48 @@
 """
 Views to send private files.
 """
+import inspect
 import os
+import time
+import zipfile
 from urllib.parse import quote
 
 from django.core.exceptions import PermissionDenied
-from django.http import Http404
+from django.http import Http404, StreamingHttpResponse
 from django.utils.module_loading import import_string
+from django.utils.text import slugify
 from django.views.generic import View
 from django.views.generic.detail import SingleObjectMixin
 
-from . import appconfig
+try:
+    from asgiref.sync import sync_to_async
+except ImportError:  # Django < 3.0
+    sync_to_async = None
+
+from . import appconfig, signals
+from .cache import get_permission
 from .models import PrivateFile
-from .servers import get_server_class
+from .servers import AsyncDjangoStreamingServer, add_no_cache_headers, get_server_class
 from .storage import private_storage
+from .streaming import aiter_measured, iter_measured, iter_zip
+from .tokens import check_token
+
+
+class LazySetting:
+    """
+    A class attribute that is resolved on first use, so importing this module doesn't import the configured classes.
+    The value is returned as-is, so functions behave like a ``staticmethod``.
+    """
+
+    def __init__(self, resolve):
+        self.resolve = resolve
+
+    def __get__(self, instance, owner=None):
+        try:
+            return self.value
+        except AttributeError:
+            self.value = self.resolve()
+            return self.value
 
 
 class PrivateStorageView(View):
@@ -25,10 +54,10 @@ class PrivateStorageView(View):
     storage = private_storage
 
     #: The authorisation rule for accessing
-    can_access_file = staticmethod(import_string(appconfig.PRIVATE_STORAGE_AUTH_FUNCTION))
+    can_access_file = LazySetting(lambda: import_string(appconfig.PRIVATE_STORAGE_AUTH_FUNCTION))
 
-    #: Import the server class once
-    server_class = get_server_class(appconfig.PRIVATE_STORAGE_SERVER)
+    #: Import the server class once, when it's first used
+    server_class = LazySetting(lambda: get_server_class(appconfig.PRIVATE_STORAGE_SERVER))
 
     #: Whether the file should be displayed ``inline`` or show a download box (``attachment``).
     content_disposition = None
@@ -39,6 +68,9 @@ class PrivateStorageView(View):
     #: Message to be displayed when the user cannot access the requested file.
     permission_denied_message = "Private storage access denied"
 
+    #: Whether the timings are sent in a ``Server-Timing`` header.
+    server_timing = appconfig.PRIVATE_STORAGE_SERVER_TIMING
+
     def get_path(self):
         """
         Determine the path for the object to provide.
@@ -67,16 +99,33 @@ class PrivateStorageView(View):
         """
         Handle incoming GET requests
         """
+        self.start_time = time.perf_counter()
         private_file = self.get_private_file()
 
-        if not self.can_access_file(private_file):
+        if not self.check_access(private_file):
             raise PermissionDenied(self.permission_denied_message)
+        private_file.add_timing('auth', self.start_time)
 
         if not private_file.exists():
             return self.serve_file_not_found(private_file)
         else:
             return self.serve_file(private_file)
 
+    def check_access(self, private_file):
+        """
+        Call :meth:`can_access_file`, or reuse the earlier decision when ``PRIVATE_STORAGE_PERMISSION_CACHE`` is set.
+        The decisions are cached separately for each view class and access function.
+        """
+        check = self.can_access_file
+        func = getattr(check, '__func__', check)
+        qualname = getattr(func, '__qualname__', None)
+        if qualname is None or '<' in qualname:
+            # Lambdas, nested functions and callable objects have no unique name, so their decisions are not cached.
+            return check(private_file)
+
+        scope = f'{self.__class__.__module__}.{self.__class__.__qualname__}:{func.__module__}.{qualname}'
+        return get_permission(private_file, check, scope=scope)
+
     def serve_file_not_found(self, private_file):
         """
         Display a response message telling that the file is not found.
@@ -99,18 +148,72 @@ class PrivateStorageView(View):
         :type private_file: :class:`private_storage.models.PrivateFile`
         :rtype: django.http.HttpResponse
         """
-        response = self.server_class().serve(private_file)
+        # Servers that redirect elsewhere need to pass the header on.
+        private_file.content_disposition = self.get_content_disposition(private_file)
 
-        if self.content_disposition:
-            # Join syntax works in all Python versions. Python 3 doesn't support b'..'.format(),
-            # and % formatting was added for bytes in 3.5: https://bugs.python.org/issue3982
-            filename = self.get_content_disposition_filename(private_file)
-            response['Content-Disposition'] = b'; '.join([
-                self.content_disposition.encode(), self._encode_filename_header(filename)
-            ])
+        start = time.perf_counter()
+        response = self.server_class().serve(private_file)
+        private_file.add_timing('serve', start)
 
+        if private_file.content_disposition:
+            response['Content-Disposition'] = private_file.content_disposition
+        self.instrument_response(private_file, response)
         return response
 
+    def instrument_response(self, private_file, response):
+        """
+        Add the ``Server-Timing`` header, and send the :mod:`~private_storage.signals`.
+        """
+        if self.server_timing:
+            response['Server-Timing'] = self.get_server_timing(private_file.timings)
+
+        signal_kwargs = {
+            'request': self.request,
+            'private_file': private_file,
+            'response': response,
+            'server_class': self.server_class,
+            'timings': private_file.timings,
+        }
+        signals.file_served.send(sender=self.__class__, **signal_kwargs)
+        if not signals.file_sent.has_listeners(self.__class__):
+            return
+
+        start_time = getattr(self, 'start_time', None) or time.perf_counter()
+
+        def _file_sent(bytes_sent, first_byte_time):
+            if first_byte_time is not None:
+                private_file.timings['first_byte'] = first_byte_time - start_time
+            private_file.timings['total'] = time.perf_counter() - start_time
+            signals.file_sent.send(sender=self.__class__, bytes_sent=bytes_sent, **signal_kwargs)
+
+        if not response.streaming:
+            _file_sent(len(response.content), time.perf_counter() if response.content else None)
+        elif getattr(response, 'is_async', False):
+            response.streaming_content = aiter_measured(response.streaming_content, _file_sent)
+        else:
+            # This replaces the file of a FileResponse, so 'wsgi.file_wrapper' is no longer used.
+            response.streaming_content = iter_measured(response.streaming_content, _file_sent)
+
+    def get_server_timing(self, timings):
+        """
+        Return the ``Server-Timing`` header value, with the durations in milliseconds.
+        """
+        return ', '.join(f'{step};dur={duration * 1000:.3f}' for step, duration in timings.items())
+
+    def get_content_disposition(self, private_file):
+        """
+        Return the ``Content-Disposition`` header when :attr:`content_disposition` is set.
+        """
+        if not self.content_disposition:
+            return None
+
+        # Join syntax works in all Python versions. Python 3 doesn't support b'..'.format(),
+        # and % formatting was added for bytes in 3.5: https://bugs.python.org/issue3982
+        filename = self.get_content_disposition_filename(private_file)
+        return b'; '.join([
+            self.content_disposition.encode(), self._encode_filename_header(filename)
+        ])
+
     def get_content_disposition_filename(self, private_file):
         """
         Return the filename in the download header.
@@ -139,6 +242,81 @@ class PrivateStorageView(View):
             return f"filename*=UTF-8''{rfc2231_filename}".encode("utf-8")
 
 
+class AsyncPrivateStorageView(PrivateStorageView):
+    """
+    Return the uploaded files, for ASGI deployments.
+
+    The permission check and metadata lookup run in a thread,
+    and the file is streamed using an async iterator. This requires Django 4.2 or newer.
+    """
+
+    #: The server class, which streams the file asynchronously.
+    server_class = AsyncDjangoStreamingServer
+
+    async def get(self, request, *args, **kwargs):
+        """
+        Handle incoming GET requests
+        """
+        self.start_time = time.perf_counter()
+        private_file = self.get_private_file()
+
+        # The permission check may query the database, so this runs in the thread_sensitive executor.
+        if not await sync_to_async(self.check_access)(private_file):
+            raise PermissionDenied(self.permission_denied_message)
+        private_file.add_timing('auth', self.start_time)
+
+        if not await sync_to_async(private_file.exists, thread_sensitive=False)():
+            return self.serve_file_not_found(private_file)
+        else:
+            return await self.serve_file(private_file)
+
+    async def serve_file(self, private_file):
+        """
+        Serve the file that was retrieved from the storage.
+        Synchronous server classes (e.g. ``nginx``) are called in a thread.
+
+        :type private_file: :class:`private_storage.models.PrivateFile`
+        :rtype: django.http.HttpResponse
+        """
+        private_file.content_disposition = self.get_content_disposition(private_file)
+
+        start = time.perf_counter()
+        serve = self.server_class().serve
+        if inspect.iscoroutinefunction(serve):
+            response = await serve(private_file)
+        else:
+            response = await sync_to_async(serve, thread_sensitive=False)(private_file)
+        private_file.add_timing('serve', start)
+
+        if private_file.content_disposition:
+            response['Content-Disposition'] = private_file.content_disposition
+        self.instrument_response(private_file, response)
+        return response
+
+
+class PrivateStorageTokenView(PrivateStorageView):
+    """
+    Return the files for URLs that were generated with :func:`~private_storage.tokens.get_token_url`.
+
+    The access check only verifies the signed token. The user is never loaded,
+    and the session is only read for tokens that are bound to a user.
+    This suits links in emails, or a CDN that fetches files from the origin.
+    """
+
+    def get_token(self):
+        """
+        Return the token from the URL.
+        """
+        return self.kwargs['token']
+
+    def check_access(self, private_file):
+        # Skip the permission cache, as it reads the user.
+        return self.can_access_file(private_file)
+
+    def can_access_file(self, private_file):
+        return check_token(self.get_token(), private_file.relative_name, self.request)
+
+
 class PrivateStorageDetailView(SingleObjectMixin, PrivateStorageView):
     """
     Download a document based on an object ID.
@@ -166,13 +344,30 @@ class PrivateStorageDetailView(SingleObjectMixin, PrivateStorageView):
         return field.storage
 
     def get_private_file(self):
+        field = self.object._meta.get_field(self.model_file_field)
+        relative_name = self.get_path()
+
+        # The metadata that the model recorded avoids asking the storage for it.
+        metadata = getattr(field, 'get_file_metadata', lambda instance: {})(self.object)
+
+        # Deduplicated files are named after their content hash, which makes a strong ETag.
+        content_hash = getattr(field, 'get_content_hash', lambda name: None)(relative_name)
+        if content_hash:
+            metadata['etag'] = f'"{content_hash}"'
+
         # Provide the parent object as well.
-        return PrivateFile(
+        # The storage is only skipped when all metadata the servers need is known,
+        # otherwise it's still asked whether the file exists, and for the missing values.
+        private_file = PrivateFile(
             request=self.request,
             storage=self.get_storage(),
-            relative_name=self.get_path(),
-            parent_object=self.object
+            relative_name=relative_name,
+            parent_object=self.object,
+            metadata=metadata if {'size', 'modified_time', 'etag'} <= metadata.keys() else None,
         )
+        for key, value in metadata.items():
+            setattr(private_file, key, value)
+        return private_file
 
     def can_access_file(self, private_file):
         """
@@ -181,3 +376,120 @@ class PrivateStorageDetailView(SingleObjectMixin, PrivateStorageView):
         but this should likely be redefined.
         """
         return PrivateStorageView.can_access_file(private_file)
+
+
+class PrivateStorageZipView(SingleObjectMixin, PrivateStorageView):
+    """
+    Download multiple files of an object as a single ZIP file.
+    The archive is generated while it's being sent, so memory usage stays the same for any archive size.
+
+    By default, the files of the :attr:`model_file_fields` are included.
+    Override :meth:`get_private_files` to include other files, e.g. from related objects.
+    Implement access controls by overriding :meth`get_queryset` or redefining :meth:`can_access_files`.
+    """
+
+    #: Define the model to fetch.
+    model = None
+
+    #: Define which fields of the object are included in the archive.
+    model_file_fields = ()
+
+    #: The ZIP file is offered as download by default.
+    content_disposition = 'attachment'
+
+    #: Content types that are already compressed, and are stored in the archive as-is.
+    stored_content_types = (
+        'image/', 'video/', 'audio/',
+        'application/zip', 'application/gzip', 'application/x-gzip', 'application/x-bzip2', 'application/x-xz',
+        'application/x-7z-compressed', 'application/vnd.rar', 'application/x-rar-compressed',
+        'application/pdf',
+        'application/vnd.openxmlformats-officedocument.', 'application/vnd.oasis.opendocument.',
+    )
+
+    def get(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        private_files = list(self.get_private_files())
+
+        if not self.can_access_files(private_files):
+            raise PermissionDenied(self.permission_denied_message)
+
+        private_files = [private_file for private_file in private_files if private_file.exists()]
+        if not private_files:
+            return self.serve_file_not_found(None)
+        else:
+            return self.serve_files(private_files)
+
+    def get_private_files(self):
+        """
+        Return the files to include in the archive.
+        """
+        for field_name in self.model_file_fields:
+            file = getattr(self.object, field_name)
+            if file:
+                yield PrivateFile(
+                    request=self.request,
+                    storage=file.storage,
+                    relative_name=file.name,
+                    parent_object=self.object
+                )
+
+    def can_access_files(self, private_files):
+        """
+        The authorization rule for all files of the archive.
+        By default, every file is checked with :meth:`can_access_file`.
+        This can be redefined to check all files at once, e.g. in a single database query.
+        """
+        return all(self.check_access(private_file) for private_file in private_files)
+
+    def can_access_file(self, private_file):
+        """
+        The authorization rule for a single file.
+        By default it reuses the ``PRIVATE_STORAGE_AUTH_FUNCTION`` setting,
+        but this should likely be redefined.
+        """
+        return PrivateStorageView.can_access_file(private_file)
+
+    @add_no_cache_headers
+    def serve_files(self, private_files):
+        """
+        Stream the ZIP file with all files.
+        """
+        entries = self.get_zip_entries(private_files)
+        response = StreamingHttpResponse(iter_zip(entries), content_type='application/zip')
+        content_disposition = self.get_content_disposition(None)
+        if content_disposition:
+            response['Content-Disposition'] = content_disposition
+        return response
+
+    def get_zip_entries(self, private_files):
+        """
+        Return the ``(arcname, private_file, compress_type)`` for every file in the archive.
+        """
+        used_names = set()
+        for private_file in private_files:
+            arcname = self.get_zip_arcname(private_file)
+            base, ext = os.path.splitext(arcname)
+            counter = 1
+            while arcname in used_names:
+                counter += 1
+                arcname = f'{base} ({counter}){ext}'
+            used_names.add(arcname)
+
+            if private_file.content_type.startswith(self.stored_content_types):
+                compress_type = zipfile.ZIP_STORED
+            else:
+                compress_type = zipfile.ZIP_DEFLATED
+
+            yield arcname, private_file, compress_type
+
+    def get_zip_arcname(self, private_file):
+        """
+        Return the filename of a file inside the archive.
+        """
+        return os.path.basename(private_file.relative_name)
+
+    def get_content_disposition_filename(self, private_file):
+        """
+        Return the filename of the ZIP file.
+        """
+        return self.content_disposition_filename or '{}.zip'.format(slugify(str(self.object)) or 'download')
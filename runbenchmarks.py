@@ -0,0 +1,483 @@
+#!/usr/bin/env python
+"""
+Benchmark the download path: ``PrivateStorageView.get()`` -> ``can_access_file()``
+-> ``exists()`` -> ``server_class.serve()`` -> reading the response body.
+
+Each scenario is a combination of server class, storage backend, file size and HTTP method.
+The view is called directly, without the WSGI handler or middleware,
+so the numbers reflect the overhead of this package and the storage.
+
+The ``remote`` backend mimics S3/MinIO: every metadata lookup and every opened
+(ranged) download waits for ``--latency`` milliseconds, like a request to the bucket would.
+
+The results are written as JSON, and can be compared against an earlier run::
+
+    python runbenchmarks.py --output baseline.json
+    python runbenchmarks.py --compare baseline.json
+
+With ``--startup``, the time to import the models and views in a new process is measured instead,
+which is what every management command and new worker process pays.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure(
+        DEBUG=False,
+        DATABASES={},
+        INSTALLED_APPS=(
+            'private_storage',
+        ),
+        USE_TZ=True,
+        PRIVATE_STORAGE_ROOT=tempfile.mkdtemp(prefix='private-storage-bench-'),
+    )
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.core.files.storage import Storage  # noqa: E402
+from django.test import RequestFactory  # noqa: E402
+
+from private_storage.memorycache import memory_cache  # noqa: E402
+from private_storage.servers import get_server_class  # noqa: E402
+from private_storage.storage.files import PrivateFileSystemStorage  # noqa: E402
+from private_storage.views import PrivateStorageView  # noqa: E402
+
+KB = 1024
+MB = 1024 * KB
+GB = 1024 * MB
+
+SERVERS = ('django', 'streaming', 'apache', 'nginx')
+BACKENDS = ('local', 'remote')
+METHODS = ('GET', 'HEAD')
+SIZES = (KB, 64 * KB, MB, 16 * MB, 256 * MB, GB)
+
+#: The storage classes of the ``--startup`` benchmark.
+STARTUP_STORAGES = {
+    'local': 'private_storage.storage.files.PrivateFileSystemStorage',
+    'remote': 'private_storage.storage.s3boto3.PrivateS3BotoStorage',
+}
+
+STARTUP_CODE = """
+import sys, time
+start = time.perf_counter()
+import django
+from django.conf import settings
+settings.configure(
+    INSTALLED_APPS=['django.contrib.contenttypes', 'django.contrib.auth', 'private_storage'],
+    DATABASES={},
+    PRIVATE_STORAGE_CLASS=sys.argv[1],
+    PRIVATE_STORAGE_ROOT='/tmp',
+)
+django.setup()
+import private_storage.fields, private_storage.views
+print(time.perf_counter() - start)
+"""
+
+#: The values that are compared with ``--compare``, and whether a higher value is better.
+COMPARED_VALUES = {
+    'requests_per_second': True,
+    'p50_ms': False,
+    'p99_ms': False,
+    'peak_memory_bytes': False,
+}
+
+
+class BenchmarkUser:
+    """
+    A user that passes the default ``allow_superuser`` check, without needing a database.
+    """
+    is_authenticated = True
+    is_staff = True
+    is_superuser = True
+
+
+class RemoteBody:
+    """
+    The response body of a (ranged) GET request on the remote storage.
+    """
+
+    def __init__(self, length):
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        self.remaining -= size
+        return bytes(size)
+
+    def close(self):
+        pass
+
+
+class RemoteStorage(Storage):
+    """
+    A storage that behaves like S3 or MinIO, with an injected round-trip latency.
+    Files have no local path, and only contain zeros.
+    """
+
+    def __init__(self, files, latency=0.0):
+        self.files = files
+        self.latency = latency
+        self.modified_time = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+    def _round_trip(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def stat(self, name):
+        self._round_trip()
+        if name not in self.files:
+            return None
+        return {
+            'size': self.files[name],
+            'modified_time': self.modified_time,
+            'content_type': 'application/octet-stream',
+            'etag': f'"{name}"',
+        }
+
+    def exists(self, name):
+        return self.stat(name) is not None
+
+    def size(self, name):
+        return self.stat(name)['size']
+
+    def get_modified_time(self, name):
+        return self.stat(name)['modified_time']
+
+    def get_etag(self, name):
+        return self.stat(name)['etag']
+
+    def open_range(self, name, start, end):
+        self._round_trip()
+        return RemoteBody(end - start + 1)
+
+    def _open(self, name, mode='rb'):
+        return self.open_range(name, 0, self.files[name] - 1)
+
+    def presigned_url(self, name, expire=60, content_type=None, content_disposition=None):
+        return f'https://bucket.example.com/{name}?X-Amz-Expires={expire}'
+
+
+def create_local_files(storage, sizes):
+    """
+    Create the files for the ``local`` backend.
+    These are sparse files, so even the largest sizes are created instantly.
+    """
+    names = {}
+    for size in sizes:
+        name = f'bench-{size}.bin'
+        with open(storage.path(name), 'wb') as f:
+            f.truncate(size)
+        names[size] = name
+    return names
+
+
+def consume_response(response, method):
+    """
+    Read the response body like a WSGI server without ``wsgi.file_wrapper`` does.
+    """
+    sent = 0
+    try:
+        if method == 'GET' and response.status_code == 200:
+            for chunk in response:
+                sent += len(chunk)
+    finally:
+        response.close()
+    return sent
+
+
+def percentile(sorted_values, percent):
+    """
+    Return the percentile of the sorted values, using the nearest-rank method.
+    """
+    index = max(0, -(-len(sorted_values) * percent // 100) - 1)
+    return sorted_values[int(index)]
+
+
+def run_scenario(view, name, method, requests, memory_requests):
+    """
+    Time the requests, and measure the peak memory usage in a separate pass,
+    because tracing memory allocations slows everything down.
+    """
+    factory = RequestFactory()
+    user = BenchmarkUser()
+
+    def do_request():
+        request = factory.generic(method, f'/{name}')
+        request.user = user
+        response = view(request, path=name)
+        if response.status_code != 200:
+            raise RuntimeError(f"Unexpected status {response.status_code} for {method} {name}")
+        return consume_response(response, method)
+
+    if requests > 3:
+        do_request()  # warm-up
+
+    timings = []
+    bytes_sent = 0
+    total_start = time.perf_counter()
+    for _ in range(requests):
+        start = time.perf_counter()
+        bytes_sent += do_request()
+        timings.append(time.perf_counter() - start)
+    total_time = time.perf_counter() - total_start
+
+    peak_memory = 0
+    for _ in range(memory_requests):
+        tracemalloc.start()
+        try:
+            do_request()
+            peak_memory = max(peak_memory, tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+
+    timings.sort()
+    return {
+        'requests': requests,
+        'requests_per_second': round(requests / total_time, 2),
+        'p50_ms': round(percentile(timings, 50) * 1000, 3),
+        'p99_ms': round(percentile(timings, 99) * 1000, 3),
+        'peak_memory_bytes': peak_memory,
+        'bytes_sent': bytes_sent,
+    }
+
+
+def run_startup_benchmarks(options):
+    """
+    Measure the time to start a process that imports the models and views.
+    """
+    results = []
+    for backend in options.backends:
+        timings = []
+        for _ in range(options.min_requests):
+            output = subprocess.run(
+                [sys.executable, '-c', STARTUP_CODE, STARTUP_STORAGES[backend]],
+                check=True, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+            ).stdout
+            timings.append(float(output))
+
+        timings.sort()
+        result = {
+            'server': 'startup',
+            'backend': backend,
+            'size': 0,
+            'method': 'import',
+            'requests': len(timings),
+            'requests_per_second': round(len(timings) / sum(timings), 2),
+            'p50_ms': round(percentile(timings, 50) * 1000, 3),
+            'p99_ms': round(percentile(timings, 99) * 1000, 3),
+            'peak_memory_bytes': 0,
+            'bytes_sent': 0,
+        }
+        results.append(result)
+        print(format_result(result), file=sys.stderr)
+    return results
+
+
+def get_request_count(size, method, options):
+    """
+    Limit the number of requests for large files, so each scenario reads at most ``--max-bytes``.
+    """
+    if method == 'HEAD':
+        return options.requests
+    return max(options.min_requests, min(options.requests, options.max_bytes // size))
+
+
+def run_benchmarks(options):
+    local_storage = PrivateFileSystemStorage()
+    local_names = create_local_files(local_storage, options.sizes)
+    remote_storage = RemoteStorage(
+        files={name: size for size, name in local_names.items()},
+        latency=options.latency / 1000,
+    )
+    storages = {
+        'local': local_storage,
+        'remote': remote_storage,
+    }
+
+    results = []
+    for server in options.servers:
+        server_class = get_server_class(server)
+        for backend in options.backends:
+            if backend == 'remote' and server == 'apache':
+                # X-Sendfile needs a local path.
+                continue
+
+            view = PrivateStorageView.as_view(storage=storages[backend], server_class=server_class)
+            for size in options.sizes:
+                for method in options.methods:
+                    scenario = {
+                        'server': server,
+                        'backend': backend,
+                        'size': size,
+                        'method': method,
+                    }
+                    requests = get_request_count(size, method, options)
+                    scenario.update(run_scenario(view, local_names[size], method, requests, options.memory_requests))
+                    results.append(scenario)
+                    print(format_result(scenario), file=sys.stderr)
+
+    return results
+
+
+def format_size(size):
+    for unit, factor in (('GB', GB), ('MB', MB), ('KB', KB)):
+        if size >= factor and size % factor == 0:
+            return f'{size // factor}{unit}'
+    return f'{size}B'
+
+
+def format_result(result):
+    return (
+        "{server:<10} {backend:<7} {size_label:>6} {method:<4} {requests_per_second:>10.1f} req/s"
+        "  p50 {p50_ms:>9.3f}ms  p99 {p99_ms:>9.3f}ms  peak {peak_kb:>8.1f}KB"
+    ).format(size_label=format_size(result['size']), peak_kb=result['peak_memory_bytes'] / KB, **result)
+
+
+def get_scenario_key(result):
+    return result['server'], result['backend'], result['size'], result['method']
+
+
+def compare_results(baseline, results, tolerance):
+    """
+    Return a description of every value that became worse than the tolerance allows.
+    """
+    baseline_results = {get_scenario_key(result): result for result in baseline['results']}
+    regressions = []
+    for result in results:
+        old = baseline_results.get(get_scenario_key(result))
+        if old is None:
+            continue
+
+        for key, higher_is_better in COMPARED_VALUES.items():
+            old_value, new_value = old[key], result[key]
+            if not old_value:
+                continue
+            change = (new_value - old_value) / old_value
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append("{} {}: {} -> {} ({:+.0%})".format(
+                    ' '.join(map(str, get_scenario_key(result))), key, old_value, new_value, change
+                ))
+    return regressions
+
+
+def parse_sizes(value):
+    sizes = []
+    for size in value.split(','):
+        size = size.strip().upper()
+        for unit, factor in (('GB', GB), ('MB', MB), ('KB', KB), ('B', 1)):
+            if size.endswith(unit):
+                sizes.append(int(size[:-len(unit)]) * factor)
+                break
+        else:
+            sizes.append(int(size))
+    return sizes
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the private file download path.")
+    parser.add_argument(
+        '--servers', type=lambda value: value.split(','), default=SERVERS,
+        help="Comma separated list of PRIVATE_STORAGE_SERVER values (default: %(default)s).",
+    )
+    parser.add_argument(
+        '--backends', type=lambda value: value.split(','), default=BACKENDS,
+        help="Comma separated list of 'local' and 'remote' (default: %(default)s).",
+    )
+    parser.add_argument(
+        '--methods', type=lambda value: value.upper().split(','), default=METHODS,
+        help="Comma separated list of HTTP methods (default: %(default)s).",
+    )
+    parser.add_argument(
+        '--sizes', type=parse_sizes, default=SIZES,
+        help="Comma separated list of file sizes, e.g. '1KB,1MB,1GB'.",
+    )
+    parser.add_argument('--requests', type=int, default=200, help="Requests per scenario (default: %(default)s).")
+    parser.add_argument(
+        '--min-requests', type=int, default=3, help="Minimal requests per scenario (default: %(default)s).",
+    )
+    parser.add_argument(
+        '--max-bytes', type=parse_sizes, default=[GB],
+        help="Limit the bytes read per scenario, by doing fewer requests for large files (default: 1GB).",
+    )
+    parser.add_argument(
+        '--memory-requests', type=int, default=1,
+        help="Requests to measure the peak memory usage with (default: %(default)s).",
+    )
+    parser.add_argument(
+        '--latency', type=float, default=20.0,
+        help="Round-trip latency of the remote backend, in milliseconds (default: %(default)s).",
+    )
+    parser.add_argument(
+        '--memory-cache', type=parse_sizes, default=[0],
+        help="Enable PRIVATE_STORAGE_MEMORY_CACHE_SIZE with this size, e.g. '64MB' (default: disabled).",
+    )
+    parser.add_argument(
+        '--startup', action='store_true',
+        help="Measure the startup time of a process instead, using --min-requests processes per backend.",
+    )
+    parser.add_argument('--output', help="Write the JSON results to this file instead of stdout.")
+    parser.add_argument('--compare', help="Compare the results with an earlier JSON output.")
+    parser.add_argument(
+        '--tolerance', type=float, default=0.2,
+        help="Allowed relative change before --compare reports a regression (default: %(default)s).",
+    )
+    options = parser.parse_args(argv)
+    options.max_bytes = options.max_bytes[0]
+    options.memory_cache = options.memory_cache[0]
+    return options
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    memory_cache.max_size = options.memory_cache
+    try:
+        results = run_startup_benchmarks(options) if options.startup else run_benchmarks(options)
+    finally:
+        shutil.rmtree(settings.PRIVATE_STORAGE_ROOT, ignore_errors=True)
+
+    output = {
+        'environment': {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'platform': platform.platform(),
+            'date': datetime.now(timezone.utc).isoformat(),
+            'latency_ms': options.latency,
+            'memory_cache': options.memory_cache,
+        },
+        'results': results,
+    }
+    data = json.dumps(output, indent=2)
+    if options.output:
+        with io.open(options.output, 'w') as f:
+            f.write(data + '\n')
+    else:
+        print(data)
+
+    if options.compare:
+        with io.open(options.compare) as f:
+            baseline = json.load(f)
+        regressions = compare_results(baseline, results, options.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -42,6 +42,7 @@ if not settings.configured:
             },
         ],
         DEFAULT_AUTO_FIELD='django.db.models.BigAutoField',
+        SECRET_KEY='private-storage-tests',
         AWS_PRIVATE_STORAGE_BUCKET_NAME='foobar',
         PRIVATE_STORAGE_ROOT=path.join(module_root, 'test-media-root'),
     )